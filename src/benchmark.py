@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import cv2
+import json
+import logging
+import multiprocessing
+import numpy as np
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+
+from framesources import CachedFrameSource
+from framesources import frameSourceFromSpec
+from gallery import Gallery
+from plugin import Plugin
+from utilities import Enroller
+from utilities import Enrollment
+from utilities import StopWatch
+from utilities import objectDetector
+
+
+__all__ = ["run",
+           "compare"]
+
+
+_RESOLUTIONS = [(320, 240), (640, 480), (1280, 720)]
+_SCALE_FACTORS = [0.25, 0.35, 0.5]
+_GALLERY_SIZES = [10, 100, 1000, 10000]
+
+
+def _stats(times):
+    times = np.array(times, dtype=np.float64)
+    return {"median": float(np.median(times)),
+            "p95": float(np.percentile(times, 95)),
+            "n": len(times)}
+
+
+def _time(f, repetitions):
+    times = []
+    stopWatch = StopWatch()
+    for _ in xrange(repetitions):
+        stopWatch.start()
+        f()
+        times.append(stopWatch.elapsedTime)
+    return times
+
+
+def _loadFrames(spec, count):
+    source = CachedFrameSource(frameSourceFromSpec(spec, False), count,
+                               loop=False)
+    frames = []
+    while True:
+        frame = source.read()
+        if frame is None:
+            break
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    return frames
+
+
+def _centerBBox(frame):
+    h, w = frame.shape
+    d = min(w, h) / 2
+    return (w - d) / 2, (h - d) / 2, d, d
+
+
+def _benchDetection(results, detectorPath, frames):
+    for w, h in _RESOLUTIONS:
+        resized = [cv2.resize(f, (w, h)) for f in frames]
+        for sf in _SCALE_FACTORS:
+            detector = objectDetector(detectorPath,
+                                      subsamplingScaleFactor=sf)
+            times = []
+            stopWatch = StopWatch()
+            for frame in resized:
+                stopWatch.start()
+                detector(frame, False)
+                times.append(stopWatch.elapsedTime)
+            results["detection/%dx%d/sf%.2f" % (w, h, sf)] = _stats(times)
+
+    # tiling needs a bounded object size, so it's compared against the
+    # untiled detector with the same one
+    w, h = _RESOLUTIONS[-1]
+    resized = [cv2.resize(f, (w, h)) for f in frames]
+    for name, tiles in [("untiled", None), ("tiled2x2", (2, 2))]:
+        detector = objectDetector(detectorPath, minObjRelDim=0.05,
+                                  maxObjRelDim=0.25, tiles=tiles)
+        results["detection/%dx%d/%s" % (w, h, name)] = _stats(_time( \
+            lambda: [detector(f, False) for f in resized], 1))
+
+
+def _enroll(frames, samples):
+    enroller = Enroller(samples, 1e-9)
+    times = []
+    stopWatch = StopWatch()
+    i = 0
+    while enroller.progress < 1:
+        frame = frames[i % len(frames)]
+        stopWatch.start()
+        enroller.enroll(frame, _centerBBox(frame))
+        times.append(stopWatch.elapsedTime)
+        i += 1
+    return enroller.enrollment, times
+
+
+def _benchEnrollments(results, frames, samples, repetitions):
+    enrollment, times = _enroll(frames, samples)
+    # the last sample also writes the pack, which is timed on its own
+    results["enroll/sample"] = _stats(times[:-1] or times)
+    results["enroll/pack/%d" % samples] = _stats(_time( \
+        lambda: enrollment.saveAs("benchmark"), repetitions))
+    Enrollment("benchmark").delete()
+    # a fresh instance per load, so nothing is cached between loads; the
+    # crops are mapped lazily, so they're copied to really be read
+    results["getProcessedFaces/%d" % samples] = _stats(_time( \
+        lambda: Enrollment(enrollment.id).getProcessedFaces( \
+        lambda crop, bbox: np.array(crop)), repetitions))
+    return enrollment
+
+
+def _benchTechniques(results, pluginsPath, frames, enrollments, gallerySizes,
+                     repetitions):
+    # the users share a few enrollments, which keeps the big galleries cheap
+    # to build while every user still costs its technique a full enrollment
+    frame = frames[0]
+    bbox = _centerBBox(frame)
+    # the techniques read the faces from a gallery of every size, built from
+    # the enrollments processed once
+    galleries = {}
+    enrollmentsFaces = None
+    for size in gallerySizes:
+        gallery = galleries[size] = Gallery(os.path.join(Enroller._BASE_PATH,
+                                                         "gallery%d" % size))
+        if enrollmentsFaces is None:
+            enrollmentsFaces = [gallery.enrollmentFaces(e) for e in \
+                enrollments]
+        results["gallery/%d" % size] = _stats(_time( \
+            lambda: gallery.extend(("user%05d" % i, enrollmentsFaces[i % \
+            len(enrollments)]) for i in xrange(size)), 1))
+    names = set()
+    for pluginInfo in Plugin.discover(pluginsPath):
+        try:
+            technique = pluginInfo.instantiate()
+        except Exception as e:
+            logging.warning("Couldn't load the '%s' technique: %s.",
+                            pluginInfo.name, e)
+            continue
+        # the names are made unique as FaceRecognizer does, so techniques
+        # sharing one don't overwrite each other's results
+        origName = pluginInfo.name.strip() or pluginInfo.className
+        name = origName
+        i = 1
+        while name in names:
+            name = "%s %d" % (origName, i)
+            i += 1
+        names.add(name)
+        technique.setup()
+        try:
+            for size in gallerySizes:
+                users = dict(("user%05d" % i, enrollments[i % \
+                    len(enrollments)]) for i in xrange(size))
+                technique.gallery = galleries[size]
+                results["train/%s/%d" % (name, size)] = _stats(_time( \
+                    lambda: technique.train(users), 1))
+                results["identify/%s/%d" % (name, size)] = _stats(_time( \
+                    lambda: technique.identify(frame, bbox, 0.5),
+                    repetitions))
+        except Exception as e:
+            logging.warning("Couldn't benchmark the '%s' technique: %s.",
+                            name, e)
+        finally:
+            technique.teardown()
+
+
+def run(pluginsPath, detectorPath, source="synthetic:640x480", frames=50,
+        samples=30, enrollments=5, gallerySizes=_GALLERY_SIZES,
+        repetitions=50):
+
+    assert frames > 0, "'frames' must be > 0."
+    assert samples > 0, "'samples' must be > 0."
+    assert enrollments > 0, "'enrollments' must be > 0."
+    assert repetitions > 0, "'repetitions' must be > 0."
+
+    random.seed(0)
+    np.random.seed(0)
+    frames = _loadFrames(source, frames)
+    results = {}
+    _benchDetection(results, detectorPath, frames)
+
+    # the enrollments are written to a scratch directory, not to the
+    # application one
+    basePath = Enroller._BASE_PATH
+    Enroller._BASE_PATH = tempfile.mkdtemp(prefix="benchmark")
+    try:
+        users = [_benchEnrollments(results, frames, samples, repetitions)]
+        while len(users) < enrollments:
+            users.append(_enroll(frames, samples)[0])
+        _benchTechniques(results, pluginsPath, frames, users, gallerySizes,
+                         repetitions)
+    finally:
+        shutil.rmtree(Enroller._BASE_PATH, ignore_errors=True)
+        Enroller._BASE_PATH = basePath
+
+    return {"environment": {"python": platform.python_version(),
+                            "opencv": cv2.__version__,
+                            "numpy": np.__version__,
+                            "machine": platform.machine(),
+                            "cpus": multiprocessing.cpu_count()},
+            "source": source,
+            "results": results}
+
+
+def compare(report, baseline, tolerance=0.1):
+    # the benchmarks whose median got more than 'tolerance' slower
+    ret = []
+    for name, current in sorted(report["results"].iteritems()):
+        previous = baseline["results"].get(name)
+        if previous is None or not previous["median"] > 0:
+            continue
+        ratio = current["median"] / previous["median"]
+        if ratio > 1 + tolerance:
+            ret.append((name, previous["median"], current["median"]))
+    return ret
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Benchmarks detection, "
+                                     "enrollment and every technique.")
+    parser.add_argument("--plugins", default="./plugins")
+    parser.add_argument("--detector",
+                        default="../data/haarcascade_frontalface_alt2.xml")
+    parser.add_argument("--source", default="synthetic:640x480",
+                        help="frame source: 'video:<path>', 'images:<dir>' "
+                        "or 'synthetic[:WxH]'")
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--gallery-sizes", type=int, nargs="+",
+                        default=_GALLERY_SIZES)
+    parser.add_argument("--repetitions", type=int, default=50)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="flag the regressions against a previous output")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = run(args.plugins, args.detector, args.source, args.frames,
+                 gallerySizes=args.gallery_sizes,
+                 repetitions=args.repetitions)
+    with open(args.output, "wb") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    for name, stats in sorted(report["results"].iteritems()):
+        print "%-40s %10.3f ms" % (name, stats["median"]*1e3)
+
+    if args.compare:
+        with open(args.compare, "rb") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        for name, previous, current in regressions:
+            print "REGRESSION %s: %.3f ms -> %.3f ms" % (name, previous*1e3,
+                                                         current*1e3)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    _main()
\ No newline at end of file
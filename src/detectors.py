@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import abc
+import cv2
+import glob
+import json
+import logging
+import numpy as np
+import os
+
+from utilities import StopWatch
+from utilities import bboxOverlap
+from utilities import objectDetector
+
+
+__all__ = ["DetectorBackend",
+           "CascadeBackend",
+           "availableBackends",
+           "loadValidationSet",
+           "calibrate"]
+
+
+class DetectorBackend(object):
+
+    __metaclass__ = abc.ABCMeta
+
+    @abc.abstractproperty
+    def name(self):
+        pass
+
+    @abc.abstractmethod
+    def load(self):
+        # must return a new object with a cv2.CascadeClassifier compatible
+        # 'detectMultiScale' method; objectDetector loads one per worker
+        pass
+
+
+class CascadeBackend(DetectorBackend):
+
+    def __init__(self, filename):
+        self._filename = filename
+
+    @property
+    def name(self):
+        return os.path.splitext(os.path.basename(self._filename))[0]
+
+    def load(self):
+        classifier = cv2.CascadeClassifier(self._filename)
+        if classifier.empty():
+            raise ValueError("The detector '%s' could not be loaded." % \
+                self._filename)
+        return classifier
+
+
+def availableBackends(dataPath):
+    # Haar and LBP frontal face cascades shipped with the application
+    ret = []
+    for pattern in ("haarcascade_frontalface*.xml",
+                    "lbpcascade_frontalface*.xml"):
+        for filename in sorted(glob.glob(os.path.join(dataPath, pattern))):
+            ret.append(CascadeBackend(filename))
+    return ret
+
+
+def loadValidationSet(path):
+    # a directory of images plus an 'annotations.json' mapping each image
+    # filename to the list of its faces bboxes
+    with open(os.path.join(path, "annotations.json"), "rb") as f:
+        annotations = json.load(f)
+    ret = []
+    for filename, bboxes in sorted(annotations.iteritems()):
+        img = cv2.imread(os.path.join(path, filename),
+                         cv2.CV_LOAD_IMAGE_GRAYSCALE)
+        if img is None:
+            logging.warning("Couldn't load validation image '%s'.", filename)
+            continue
+        ret.append((img, [tuple(b) for b in bboxes]))
+    return ret
+
+
+def _recall(detector, validationSet, minOverlap):
+    found = total = 0
+    for img, bboxes in validationSet:
+        detected = detector(img, False)
+        total += len(bboxes)
+        found += sum(1 for b in bboxes if any(bboxOverlap(b, d) >= \
+            minOverlap for d in detected))
+    return float(found) / total if total else 1.
+
+
+def _resize(validationSet, frameSize):
+    ret = []
+    for img, bboxes in validationSet:
+        h, w = img.shape
+        sx, sy = float(frameSize[0]) / w, float(frameSize[1]) / h
+        ret.append((cv2.resize(img, frameSize),
+                    [(int(x*sx), int(y*sy), int(bw*sx), int(bh*sy)) for \
+                        x, y, bw, bh in bboxes]))
+    return ret
+
+
+def calibrate(backends, validationSet, frameSize, minRecall=0.9,
+              minOverlap=0.5, repetitions=3, **detectorParams):
+
+    assert backends, "At least one backend is needed."
+    assert minRecall >= 0 and minRecall <= 1, \
+        "'minRecall' must be in [0, 1] interval."
+
+    # the validation images are brought to the camera resolution, so the
+    # timings reflect the deployment
+    validationSet = _resize(validationSet, frameSize)
+    report = []
+    for backend in backends:
+        try:
+            detector = objectDetector(backend, **detectorParams)
+        except ValueError as e:
+            logging.warning("Skipping detector '%s': %s.", backend.name, e)
+            continue
+        recall = _recall(detector, validationSet, minOverlap)
+        times = []
+        stopWatch = StopWatch()
+        for _ in xrange(repetitions):
+            for img, _ in validationSet:
+                stopWatch.start()
+                detector(img, False)
+                times.append(stopWatch.elapsedTime)
+        report.append((backend, recall, float(np.median(times)) if times \
+            else 0.))
+
+    if not report:
+        raise ValueError("None of the detectors could be loaded.")
+    accepted = [r for r in report if r[1] >= minRecall]
+    if accepted:
+        best = min(accepted, key=lambda r: r[2])
+    else:
+        logging.warning("No detector reached the recall floor %.2f.",
+                        minRecall)
+        best = max(report, key=lambda r: r[1])
+    return best[0], report
\ No newline at end of file
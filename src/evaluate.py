@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+import argparse
+import cv2
+import json
+import logging
+import multiprocessing
+import numpy as np
+import os
+import sys
+
+from facerecognizer import FaceRecognizer
+from framesources import ImageFolderSource
+from framesources import VideoFileSource
+from utilities import StopWatch
+from utilities import getApplicationPath
+from utilities import objectDetector
+
+
+__all__ = ["findSamples",
+           "summarize",
+           "sweepSecurityTol",
+           "recommendedSecurityTol"]
+
+
+UNKNOWN_LABEL = "_unknown"
+
+_IMAGE_EXTENSIONS = ImageFolderSource._EXTENSIONS
+_VIDEO_EXTENSIONS = ("avi", "mkv", "mov", "mp4", "mpg", "webm")
+
+# per process state, built by the pool initializer
+_worker = {}
+
+
+def findSamples(datasetPath):
+    # the dataset has one directory per user, named after it, holding images
+    # and videos of that user; the '_unknown' directory holds impostors
+    ret = []
+    for label in sorted(os.listdir(datasetPath)):
+        labelPath = os.path.join(datasetPath, label)
+        if not os.path.isdir(labelPath):
+            continue
+        for filename in sorted(os.listdir(labelPath)):
+            ext = os.path.splitext(filename)[1][1:].lower()
+            if ext in _IMAGE_EXTENSIONS or ext in _VIDEO_EXTENSIONS:
+                ret.append((label, os.path.join(labelPath, filename)))
+    return ret
+
+
+def _frames(path):
+    ext = os.path.splitext(path)[1][1:].lower()
+    if ext in _IMAGE_EXTENSIONS:
+        frame = cv2.imread(path)
+        if frame is not None:
+            yield frame
+        return
+    source = VideoFileSource(path, realTime=False)
+    try:
+        while True:
+            frame = source.read()
+            if frame is None:
+                break
+            yield frame
+    finally:
+        source.release()
+
+
+def _initWorker(pluginsPath, statePath, detectorPath, securityTol, sweep):
+    logging.basicConfig(level=logging.WARNING)
+    _worker["sweep"] = sweep
+    _worker["detector"] = objectDetector(detectorPath)
+    _worker["faceRecognizer"] = faceRecognizer = FaceRecognizer(pluginsPath,
+        statePath=statePath)
+    faceRecognizer.securityTol = securityTol
+
+
+def _bestScore(faceRecognizer, technique, frame, bbox):
+    # in sweep mode the records hold the best scored user whatever its
+    # score, and the tolerance is applied afterwards
+    try:
+        scores = faceRecognizer.scores(frame, bbox)
+    except NotImplementedError:
+        raise ValueError("The '%s' technique doesn't provide raw scores." % \
+            technique)
+    if not scores:
+        return 0., None
+    user, score = max(scores.iteritems(), key=lambda s: s[1])
+    return score, user
+
+
+def _evaluate(task):
+    technique, label, path = task
+    detector = _worker["detector"]
+    faceRecognizer = _worker["faceRecognizer"]
+    if faceRecognizer.selectedTechniqueName != technique:
+        faceRecognizer.selectTechniqueByName(technique)
+        faceRecognizer.waitForTraining()
+    # an untrained technique would reject every face, impostors included
+    if faceRecognizer.trainingError is not None:
+        raise RuntimeError("Couldn't train the '%s' technique: %s." % \
+            (technique, faceRecognizer.trainingError))
+
+    records = []
+    stopWatch = StopWatch()
+    for i, frame in enumerate(_frames(path)):
+        grayFrame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        stopWatch.start()
+        bboxes = detector(grayFrame, False)
+        detectionLatency = stopWatch.elapsedTime
+        stopWatch.start()
+        if _worker["sweep"]:
+            identities = [_bestScore(faceRecognizer, technique, grayFrame,
+                                     bbox) for bbox in bboxes]
+        else:
+            identities = faceRecognizer.identifyMany(grayFrame, bboxes)
+        identificationLatency = stopWatch.elapsedTime
+        for bbox, (confidence, user) in zip(bboxes, identities):
+            records.append({"technique": technique,
+                            "label": label,
+                            "path": path,
+                            "frame": i,
+                            "bbox": [int(v) for v in bbox],
+                            "user": user,
+                            "confidence": float(confidence),
+                            "detectionLatency": detectionLatency,
+                            "identificationLatency": identificationLatency / \
+                                len(bboxes)})
+    return records
+
+
+def _train(faceRecognizer, techniques):
+    # every model is trained and its snapshot saved once, before the workers
+    # start and only load it, so they don't all write the same state
+    # directory; returns the errors of the techniques failing to train
+    ret = {}
+    for technique in techniques:
+        faceRecognizer.selectTechniqueByName(technique)
+        faceRecognizer.waitForTraining()
+        if faceRecognizer.trainingError is not None:
+            ret[technique] = faceRecognizer.trainingError
+    faceRecognizer.selectTechniqueByName(None)
+    return ret
+
+
+def sweepSecurityTol(records, steps=101):
+    # false accepts are accepted impostors, over the '_unknown' probes; false
+    # rejects are the genuine probes not accepted as their label, over all
+    # the genuine probes, so a genuine probe accepted as another user counts
+    # too, and is also reported as a misidentification. A probe is accepted
+    # at a tolerance when its score is > 1 - tolerance, so counting the
+    # scores above every threshold at once is a search in the sorted scores
+    scores = np.array([r["confidence"] for r in records], dtype=np.float64)
+    impostor = np.array([r["label"] == UNKNOWN_LABEL for r in records],
+                        dtype=bool)
+    right = np.array([r["user"] is not None and r["user"] == r["label"] \
+        for r in records], dtype=bool)
+    tolerances = np.linspace(0, 1, steps)
+    thresholds = 1 - tolerances
+
+    def acceptedAbove(s):
+        s = np.sort(s)
+        return len(s) - np.searchsorted(s, thresholds, side="right")
+
+    genuines = float(max(np.count_nonzero(~impostor), 1))
+    far = acceptedAbove(scores[impostor]) / \
+        float(max(np.count_nonzero(impostor), 1))
+    frr = 1 - acceptedAbove(scores[~impostor & right]) / genuines
+    mir = acceptedAbove(scores[~impostor & ~right]) / genuines
+    return tolerances, far, frr, mir
+
+
+def recommendedSecurityTol(tolerances, far, frr, maxFar=None):
+    # the highest tolerance within the false accept budget, or the equal
+    # error rate point when there is no budget
+    if maxFar is not None:
+        within = np.flatnonzero(far <= maxFar)
+        i = within[-1] if len(within) else 0
+    else:
+        i = np.argmin(np.abs(far - frr))
+    return float(tolerances[i])
+
+
+def summarize(records, elapsedTimes, sweep=False, maxFar=None):
+    # 'elapsedTimes' maps each technique to the time its faces took
+    ret = {}
+    for technique in sorted(set(r["technique"] for r in records)):
+        techniqueRecords = [r for r in records if r["technique"] == technique]
+        summary = {"faces": len(techniqueRecords),
+                   "facesPerSecond": len(techniqueRecords) / \
+                       elapsedTimes[technique]}
+        if not sweep:
+            correct = sum(1 for r in techniqueRecords if r["user"] == \
+                r["label"] or (r["user"] is None and \
+                r["label"] == UNKNOWN_LABEL))
+            summary["accuracy"] = float(correct) / len(techniqueRecords)
+        for key in ("detectionLatency", "identificationLatency"):
+            latencies = np.array([r[key] for r in techniqueRecords])
+            summary[key] = dict(("p%d" % p, float(np.percentile(latencies,
+                p))) for p in (50, 95, 99))
+        if sweep:
+            tolerances, far, frr, mir = sweepSecurityTol(techniqueRecords)
+            securityTol = recommendedSecurityTol(tolerances, far, frr, maxFar)
+            i = np.argmin(np.abs(tolerances - securityTol))
+            summary["securityTol"] = securityTol
+            summary["far"] = float(far[i])
+            summary["frr"] = float(frr[i])
+            summary["misidentification"] = float(mir[i])
+            summary["roc"] = {"securityTol": tolerances.tolist(),
+                              "far": far.tolist(),
+                              "frr": frr.tolist(),
+                              "misidentification": mir.tolist()}
+        ret[technique] = summary
+    return ret
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Streams a labeled dataset "
+                                     "through detection and identification.")
+    parser.add_argument("dataset", help="directory with one subdirectory of "
+                        "images and videos per user, plus '%s'" % \
+                        UNKNOWN_LABEL)
+    parser.add_argument("--plugins", default="./plugins")
+    parser.add_argument("--state", default=getApplicationPath(),
+                        help="directory with the users registry")
+    parser.add_argument("--detector",
+                        default="../data/haarcascade_frontalface_alt2.xml")
+    parser.add_argument("--techniques", nargs="*",
+                        help="techniques to evaluate; all when omitted")
+    parser.add_argument("--security-tol", type=float, default=0.5)
+    parser.add_argument("--processes", type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument("--output", default="results.jsonl")
+    parser.add_argument("--sweep", action="store_true",
+                        help="score every face once and compute the FAR/FRR "
+                        "curves over all the security tolerances")
+    parser.add_argument("--max-far", type=float,
+                        help="false accept rate budget of the recommended "
+                        "security tolerance; the equal error rate otherwise")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    faceRecognizer = FaceRecognizer(args.plugins, statePath=args.state)
+    techniques = args.techniques or faceRecognizer.techniquesNames
+    failures = _train(faceRecognizer, techniques)
+    for technique, e in sorted(failures.iteritems()):
+        logging.warning("Couldn't train the '%s' technique: %s.", technique, e)
+    samples = findSamples(args.dataset)
+
+    pool = multiprocessing.Pool(args.processes, _initWorker,
+                                (args.plugins, args.state, args.detector,
+                                 args.security_tol, args.sweep))
+    records = []
+    elapsedTimes = {}
+    stopWatch = StopWatch()
+    with open(args.output, "wb") as f:
+        # one technique at a time, so each one is timed on its own
+        for technique in techniques:
+            if technique in failures:
+                continue
+            tasks = [(technique, label, path) for label, path in samples]
+            stopWatch.start()
+            try:
+                for taskRecords in pool.imap_unordered(_evaluate, tasks):
+                    for r in taskRecords:
+                        f.write(json.dumps(r) + "\n")
+                    records.extend(taskRecords)
+            except (RuntimeError, ValueError) as e:
+                # untrained, or without raw scores in sweep mode
+                logging.warning("%s", e)
+                failures[technique] = e
+                records = [r for r in records if r["technique"] != technique]
+                continue
+            elapsedTimes[technique] = stopWatch.elapsedTime
+    pool.close()
+    pool.join()
+
+    if not records:
+        sys.exit("No faces were detected in the dataset.")
+    summary = summarize(records, elapsedTimes, args.sweep, args.max_far)
+    for technique, e in failures.iteritems():
+        summary[technique] = {"error": str(e)}
+    json.dump(summary, sys.stdout, indent=2, sort_keys=True)
+    print
+
+
+if __name__ == "__main__":
+    _main()
\ No newline at end of file
@@ -1,27 +1,277 @@
 # -*- coding: utf-8 -*-
 
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import threading
+
+from isolation import IsolatedTechnique
 from plugin import Plugin
+from plugin import TrainingCanceled
+from utilities import Enrollment
+from utilities import StopWatch
 
 
 __all__ = ["FaceRecognizer"]
 
 
+class _TrainingJob(object):
+
+    def __init__(self, generation, techniqueName, pluginInfo, users):
+        self.generation = generation
+        self.techniqueName = techniqueName
+        self.pluginInfo = pluginInfo
+        self.users = users
+        # set by the trainer, which instantiates the technique
+        self.technique = None
+        self.snapshotPath = None
+        self.progress = 0
+        self.canceled = False
+
+    def loadSnapshot(self):
+        if self.snapshotPath is None or not os.path.isdir(self.snapshotPath):
+            return False
+        try:
+            self.technique.loadState(self.snapshotPath)
+            return True
+        except NotImplementedError:
+            return False
+        except Exception as e:
+            logging.warning("Couldn't restore the '%s' model from '%s': %s.",
+                            self.techniqueName, self.snapshotPath, e)
+            return False
+
+    def saveSnapshot(self, isCurrent=None):
+        # 'isCurrent', when given, is called once the model is written and
+        # tells whether it's still worth keeping; a snapshot is an
+        # optimization, so it's never worth failing a training for
+        if self.snapshotPath is None:
+            return
+        tmpPath = self.snapshotPath + ".tmp"
+        shutil.rmtree(tmpPath, ignore_errors=True)
+        try:
+            os.makedirs(tmpPath)
+            self.technique.saveState(tmpPath)
+            if isCurrent is not None and not isCurrent():
+                shutil.rmtree(tmpPath, ignore_errors=True)
+                return
+            # only the latest snapshot of a technique is kept
+            modelsPath, snapshotName = os.path.split(self.snapshotPath)
+            techniqueHash = snapshotName.split("-")[0]
+            for name in os.listdir(modelsPath):
+                if name.startswith(techniqueHash + "-") and \
+                        name != os.path.basename(tmpPath):
+                    shutil.rmtree(os.path.join(modelsPath, name),
+                                  ignore_errors=True)
+            os.rename(tmpPath, self.snapshotPath)
+        except NotImplementedError:
+            shutil.rmtree(tmpPath, ignore_errors=True)
+        except Exception as e:
+            logging.warning("Couldn't save the '%s' model to '%s': %s.",
+                            self.techniqueName, self.snapshotPath, e)
+            shutil.rmtree(tmpPath, ignore_errors=True)
+
+    def onProgress(self, progress):
+        if self.canceled:
+            raise TrainingCanceled()
+        self.progress = min(max(progress, 0), 1)
+
+
+class _Trainer(threading.Thread):
+
+    def __init__(self, faceRecognizer):
+        super(_Trainer, self).__init__(name="Training")
+        self.daemon = True
+        self._faceRecognizer = faceRecognizer
+        self._cond = threading.Condition()
+        self._pendingJob = None
+        self._runningJob = None
+
+    @property
+    def currentJob(self):
+        with self._cond:
+            return self._pendingJob or self._runningJob
+
+    def submit(self, job):
+        with self._cond:
+            self._cancelLocked()
+            self._pendingJob = job
+            self._cond.notify_all()
+
+    def cancel(self):
+        with self._cond:
+            self._cancelLocked()
+            self._cond.notify_all()
+
+    def _cancelLocked(self):
+        self._pendingJob = None
+        if self._runningJob is not None:
+            self._runningJob.canceled = True
+
+    def wait(self, timeout=None):
+        stopWatch = StopWatch()
+        with self._cond:
+            while self._pendingJob or self._runningJob:
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = timeout - stopWatch.elapsedTime
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+        return True
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self._pendingJob is None:
+                    self._cond.wait()
+                job = self._runningJob = self._pendingJob
+                self._pendingJob = None
+            try:
+                # instantiating may be slow too, e.g. starting an isolated
+                # technique worker, so it's done here, not by the caller
+                job.technique = self._faceRecognizer._instantiate( \
+                    job.pluginInfo)
+                job.snapshotPath = self._faceRecognizer._snapshotPath( \
+                    job.technique, job.users)
+                job.technique._trainingProgressCallback = job.onProgress
+                self._faceRecognizer._call(job.techniqueName,
+                                           job.technique.setup)
+                if not job.loadSnapshot():
+                    self._faceRecognizer._call(job.techniqueName,
+                                               job.technique.train, job.users)
+                    job.saveSnapshot()
+                job.progress = 1
+                self._faceRecognizer._onTrainingFinished(job, None)
+            except TrainingCanceled:
+                job.technique.teardown()
+            except Exception as e:
+                logging.warning("Couldn't train the technique '%s': %s.",
+                                job.techniqueName, e)
+                if job.technique is not None:
+                    job.technique.teardown()
+                self._faceRecognizer._onTrainingFinished(job, e)
+            finally:
+                if job.technique is not None:
+                    job.technique._trainingProgressCallback = None
+                with self._cond:
+                    self._runningJob = None
+                    self._cond.notify_all()
+
+
 class FaceRecognizer(object):
 
-    def __init__(self, pluginsPath):
+    _REGISTRY_FILENAME = "users.json"
+    _MODELS_DIRNAME = "models"
+    _PLUGINS_MANIFEST_FILENAME = "plugins.json"
+
+    def __init__(self, pluginsPath, gallery=None, statePath=None,
+                 instrumentation=None, profiler=None, isolated=False):
         self._techniques = {}
         self._selectedTechniqueName = None
         self._securityTol = 0
         self._users = {}
+        # the serving technique keeps answering 'identify' while a new model
+        # is trained in background, and is swapped when the training is done
+        self._servingTechniqueName = None
+        self._servingTechnique = None
+        self._servingUsers = frozenset()
+        self._generation = 0
+        self._trainingError = None
+        self._gallery = gallery
+        self._statePath = statePath
+        # techniques are called from the recognition worker as well as from
+        # the GUI thread
+        self._lock = threading.RLock()
+        # an instrumentation.Instrumentation recording the identification
+        # latencies per technique
+        self.instrumentation = instrumentation
+        # a profiling.TechniqueProfiler for the 'setup', 'train' and
+        # 'identify' calls of the selected technique
+        self.profiler = profiler
+        # each technique instance runs in its own worker process
+        self._isolated = isolated
+
+        self._trainer = _Trainer(self)
+        self._trainer.start()
 
+        if statePath is not None:
+            self._loadRegistry()
+        if gallery is not None:
+            self._syncGallery()
         self.loadPluginsFrom(pluginsPath)
 
+    @property
+    def _registryPath(self):
+        return os.path.join(self._statePath, self._REGISTRY_FILENAME)
+
+    def _loadRegistry(self):
+        if not os.path.exists(self._registryPath):
+            return
+        with open(self._registryPath, "rb") as f:
+            registry = json.load(f)
+        for user, enrollmentId in registry.iteritems():
+            enrollment = Enrollment(enrollmentId)
+            if not enrollment.bboxes:
+                logging.warning("Missing enrollment '%s' of user '%s'.",
+                                enrollmentId, user)
+                continue
+            self._users[user] = enrollment
+
+    def _syncGallery(self):
+        # the gallery may be missing or predate the registry, which is the
+        # reference: the users it lacks are added, the unknown ones removed
+        for user in set(self._gallery.users) - set(self._users):
+            self._gallery.remove(user)
+        missing = [u for u in self._users if u not in self._gallery]
+        if missing:
+            self._gallery.extend((u, self._gallery.enrollmentFaces( \
+                self._users[u])) for u in missing)
+
+    def _saveRegistry(self):
+        if self._statePath is None:
+            return
+        try:
+            if not os.path.exists(self._statePath):
+                os.makedirs(self._statePath)
+        except os.error as e:
+            raise IOError("%s: '%s'" % (e.strerror, e.filename))
+        registry = dict((user, enrollment.id) for user, enrollment in \
+            self._users.iteritems())
+        tmpPath = self._registryPath + ".tmp"
+        with open(tmpPath, "wb") as f:
+            json.dump(registry, f)
+        # replaces the previous registry atomically
+        os.rename(tmpPath, self._registryPath)
+
+    def _snapshotPath(self, technique, users):
+        if self._statePath is None:
+            return None
+        techniqueHash = hashlib.sha1(technique.featuresKey).hexdigest()[:16]
+        usersHash = hashlib.sha1(json.dumps(sorted((user, enrollment.id) \
+            for user, enrollment in users.iteritems()))).hexdigest()[:16]
+        return os.path.join(self._statePath, self._MODELS_DIRNAME,
+                            "%s-%s" % (techniqueHash, usersHash))
+
     def loadPluginsFrom(self, newPath):
+        with self._lock:
+            self._loadPluginsFrom(newPath)
+
+    def _loadPluginsFrom(self, newPath):
         self.selectTechniqueByName(None)
         self._techniques = {}
         if newPath:
-            Plugin.load(newPath)
-            for p in Plugin.getInstances():
+            # only the selected technique is imported and instantiated
+            manifestPath = None
+            if self._statePath is not None and \
+                    os.path.isdir(self._statePath):
+                manifestPath = os.path.join(self._statePath,
+                                            self._PLUGINS_MANIFEST_FILENAME)
+            for p in Plugin.discover(newPath, manifestPath):
                 origName = p.name.strip()
                 if not origName:
                     continue
@@ -32,6 +282,10 @@ class FaceRecognizer(object):
                     i += 1
                 self._techniques[name] = p
 
+    @property
+    def gallery(self):
+        return self._gallery
+
     @property
     def techniquesNames(self):
         return self._techniques.keys()
@@ -42,14 +296,19 @@ class FaceRecognizer(object):
 
     @property
     def selectedTechnique(self):
-        if self._selectedTechniqueName is None:
+        if self._servingTechniqueName != self._selectedTechniqueName:
             return None
-        return self._techniques[self._selectedTechniqueName]
+        return self._servingTechnique
 
     def selectTechniqueByName(self, techniqueName):
+        with self._lock:
+            self._selectTechniqueByName(techniqueName)
+
+    def _selectTechniqueByName(self, techniqueName):
         if techniqueName is None:
-            if self.selectedTechnique is not None:
-                self.selectedTechnique.teardown()
+            self._generation += 1
+            self._trainer.cancel()
+            self._swapServingTechnique(None, None, frozenset())
             self._selectedTechniqueName = None
         else:
             techniqueName = techniqueName.strip()
@@ -57,11 +316,70 @@ class FaceRecognizer(object):
                 return
             if self._techniques.has_key(techniqueName) and \
                     self._selectedTechniqueName != techniqueName:
-                if self.selectedTechnique is not None:
-                    self.selectedTechnique.teardown()
                 self._selectedTechniqueName = techniqueName
-                self.selectedTechnique.setup()
-                self.selectedTechnique.train(self._users)
+                self._retrain()
+
+    def _retrain(self):
+        self._generation += 1
+        self._trainingError = None
+        self._trainer.submit(_TrainingJob(self._generation,
+            self._selectedTechniqueName,
+            self._techniques[self._selectedTechniqueName], dict(self._users)))
+
+    def _instantiate(self, pluginInfo):
+        if self._isolated:
+            technique = IsolatedTechnique(pluginInfo, self._gallery,
+                                          onFailure=self._onTechniqueFailed)
+        else:
+            technique = pluginInfo.instantiate()
+        technique.gallery = self._gallery
+        return technique
+
+    def _onTrainingFinished(self, job, error):
+        with self._lock:
+            if job.generation != self._generation:
+                if error is None:
+                    job.technique.teardown()
+                return
+            if error is not None:
+                self._trainingError = error
+                return
+            self._swapServingTechnique(job.techniqueName, job.technique,
+                                       frozenset(job.users))
+
+    def _swapServingTechnique(self, name, technique, users):
+        oldTechnique = self._servingTechnique
+        self._servingTechniqueName = name
+        self._servingTechnique = technique
+        self._servingUsers = users
+        if oldTechnique is not None:
+            oldTechnique.teardown()
+
+    def _onTechniqueFailed(self, technique, error):
+        # an isolated technique gave its worker up; the lock isn't taken,
+        # as it's held around the calls that get here
+        if technique is self._servingTechnique:
+            self._trainingError = error
+
+    @property
+    def trainingState(self):
+        if self._trainer.currentJob is not None:
+            return "training"
+        if self._trainingError is not None:
+            return "failed"
+        return "idle"
+
+    @property
+    def trainingProgress(self):
+        job = self._trainer.currentJob
+        return job.progress if job is not None else 1
+
+    @property
+    def trainingError(self):
+        return self._trainingError
+
+    def waitForTraining(self, timeout=None):
+        return self._trainer.wait(timeout)
 
     @property
     def securityTol(self):
@@ -81,34 +399,152 @@ class FaceRecognizer(object):
         user = user.strip()
         if not user:
             return
-        if self.userExists(user):
-            raise ValueError("Duplicated user.")
-        self._users[user] = enrollment
-        if self.selectedTechnique is not None:
-            self.selectedTechnique.train(self._users)
+        with self._lock:
+            if self.userExists(user):
+                raise ValueError("Duplicated user.")
+            if self._gallery is not None:
+                self._gallery.appendEnrollment(user, enrollment)
+            self._users[user] = enrollment
+            self._saveRegistry()
+            self._updateTechnique("addUser", user, enrollment)
 
     def removeUser(self, user):
         user = user.strip()
-        if not (user and self.userExists(user)):
+        with self._lock:
+            if not (user and self.userExists(user)):
+                return
+            enrollment = self._users.pop(user)
+            self._saveRegistry()
+            self._updateTechnique("removeUser", user)
+            if self._gallery is not None:
+                self._gallery.remove(user)
+            enrollment.delete()
+
+    def _updateTechnique(self, hookName, *args):
+        if self._selectedTechniqueName is None:
             return
-        self._users[user].delete()
-        del self._users[user]
-        if self.selectedTechnique is not None:
-            self.selectedTechnique.train(self._users)
+        technique = self.selectedTechnique
+        # a model being trained doesn't know about this change, so it's
+        # trained again from the current users
+        if technique is not None and self._trainer.currentJob is None:
+            try:
+                getattr(technique, hookName)(*args)
+                self._servingUsers = frozenset(self._users)
+                self._saveSnapshotInBackground(technique, dict(self._users))
+                return
+            except NotImplementedError:
+                pass
+        self._retrain()
+
+    def _saveSnapshotInBackground(self, technique, users):
+        # a model updated in place is saved like a trained one, so the next
+        # start doesn't train it again; it's skipped if the model changed
+        # again in the meantime, as that change saves its own
+        job = _TrainingJob(self._generation, self._servingTechniqueName,
+                           None, users)
+        job.technique = technique
+        job.snapshotPath = self._snapshotPath(technique, users)
+
+        def isCurrent():
+            with self._lock:
+                return self._servingTechnique is technique and \
+                    self._servingUsers == frozenset(users)
+
+        def save():
+            # the lock is only taken to check the model, so identifying
+            # doesn't wait for the write; a change made during the write is
+            # caught by the check that follows it
+            if isCurrent():
+                job.saveSnapshot(isCurrent)
+
+        saver = threading.Thread(target=save, name="Snapshot")
+        saver.daemon = True
+        saver.start()
 
     def userExists(self, user):
         return self._users.has_key(user.strip())
 
+    def _checkIdentifiedUser(self, user):
+        assert user is None or user in self._servingUsers, \
+            "The returned user '%s' isn't known. Check the consistency of " \
+            "the '%s' technique." % (user, self._servingTechniqueName)
+        # the serving model may predate the removal of some users
+        if user is not None and not self.userExists(user):
+            user = None
+        return user
+
+    def _call(self, techniqueName, f, *args):
+        if self.profiler is None:
+            return f(*args)
+        return self.profiler.call(techniqueName, f, *args)
+
+    def _recordIdentification(self, elapsedTime, faces):
+        # per face, so batched and single identifications are comparable
+        if self.instrumentation is not None:
+            self.instrumentation.record("identify:%s" % \
+                self._servingTechniqueName, elapsedTime / faces)
+
     def identify(self, frame, bbox):
-        technique = self.selectedTechnique
-        if not technique:
-            return 0, None
-        confidence, user = technique.identify(frame, bbox, self.securityTol)
+        with self._lock:
+            technique = self._servingTechnique
+            if not technique:
+                return 0, None
+            stopWatch = StopWatch()
+            confidence, user = self._call(self._servingTechniqueName,
+                                          technique.identify, frame, bbox,
+                                          self.securityTol)
+            self._recordIdentification(stopWatch.elapsedTime, 1)
 
-        assert confidence >= 0 and confidence <= 1, "The confidence must be " \
-            "in [0, 1] interval."
-        assert user is None or self.userExists(user), \
-            "The returned user '%s' isn't known. Check the consistency of " \
-            "the '%s' technique." % (user, self.selectedTechniqueName)
+            assert confidence >= 0 and confidence <= 1, "The confidence " \
+                "must be in [0, 1] interval."
+            user = self._checkIdentifiedUser(user)
+
+        return confidence, user
+
+    def scores(self, frame, bbox):
+        # raw per user scores of the serving technique, regardless of the
+        # security tolerance; raises NotImplementedError when the technique
+        # doesn't provide them
+        with self._lock:
+            technique = self._servingTechnique
+            if not technique:
+                return {}
+            scores = self._call(self._servingTechniqueName, technique.scores,
+                                frame, bbox)
+
+            assert all(s >= 0 and s <= 1 for s in scores.itervalues()), \
+                "The scores must be in [0, 1] interval."
+            for user in scores:
+                self._checkIdentifiedUser(user)
+            scores = dict((u, s) for u, s in scores.iteritems() if \
+                self.userExists(u))
+
+        return scores
+
+    def identifyMany(self, frame, bboxes):
+        if len(bboxes) == 0:
+            return []
+        with self._lock:
+            technique = self._servingTechnique
+            if not technique:
+                return [(0, None)] * len(bboxes)
+            stopWatch = StopWatch()
+            results = self._call(self._servingTechniqueName,
+                                 technique.identifyBatch, frame, bboxes,
+                                 self.securityTol)
+            self._recordIdentification(stopWatch.elapsedTime, len(bboxes))
+
+            assert len(results) == len(bboxes), "The '%s' technique must " \
+                "return one result per bbox." % self._servingTechniqueName
+            confidences = np.array([c for c, _ in results], dtype=np.float64)
+            assert np.all((confidences >= 0) & (confidences <= 1)), \
+                "The confidence must be in [0, 1] interval."
+            unknownUsers = set(u for _, u in results if u is not None) - \
+                self._servingUsers
+            assert not unknownUsers, "The returned users %s aren't known. " \
+                "Check the consistency of the '%s' technique." % \
+                (sorted(unknownUsers), self._servingTechniqueName)
+            results = [(c, u if u is None or self.userExists(u) else None) \
+                for c, u in results]
 
-        return confidence, user
\ No newline at end of file
+        return results
\ No newline at end of file
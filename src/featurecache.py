@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+import collections
+import hashlib
+import logging
+import numpy as np
+import os
+import shutil
+import threading
+import uuid
+
+
+__all__ = ["FeatureCache"]
+
+
+class FeatureCache(object):
+
+    def __init__(self, path=None, memoryBudget=64*1024*1024):
+
+        assert memoryBudget >= 0, "'memoryBudget' must be >= 0."
+
+        self._path = path
+        self._memoryBudget = memoryBudget
+        self._memoryUsage = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None:
+            try:
+                if not os.path.exists(path):
+                    os.makedirs(path)
+            except os.error as e:
+                raise IOError("%s: '%s'" % (e.strerror, e.filename))
+
+    @staticmethod
+    def key(owner, sampleHash, technique, techniqueKey):
+        # the entries are grouped by owner, e.g. an enrollment, so they're
+        # purged with it, and by technique, so the ones of its previous
+        # versions or params, 'techniqueKey', are evicted by the new ones
+        return (owner, hashlib.sha1(technique).hexdigest()[:16],
+                hashlib.sha1(techniqueKey).hexdigest()[:16], sampleHash)
+
+    @property
+    def memoryUsage(self):
+        return self._memoryUsage
+
+    def _diskPath(self, key):
+        owner, technique, techniqueKey, sampleHash = key
+        return os.path.join(self._path, owner, technique, techniqueKey,
+                            "%s.npy" % sampleHash)
+
+    def get(self, key):
+        with self._lock:
+            features = self._entries.pop(key, None)
+            if features is not None:
+                self._entries[key] = features
+                self.hits += 1
+                return features
+        features = self._loadFromDisk(key)
+        with self._lock:
+            if features is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._putInMemory(key, features)
+        return features
+
+    def put(self, key, features):
+        # the cached arrays are shared by every reader, so they're read-only
+        features = np.array(features)
+        features.flags.writeable = False
+        with self._lock:
+            self._putInMemory(key, features)
+        self._saveToDisk(key, features)
+
+    def _putInMemory(self, key, features):
+        if features.nbytes > self._memoryBudget:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._memoryUsage -= old.nbytes
+        self._entries[key] = features
+        self._memoryUsage += features.nbytes
+        while self._memoryUsage > self._memoryBudget:
+            _, evicted = self._entries.popitem(last=False)
+            self._memoryUsage -= evicted.nbytes
+
+    def _loadFromDisk(self, key):
+        if self._path is None:
+            return None
+        path = self._diskPath(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            features = np.load(path)
+            features.flags.writeable = False
+            return features
+        except (IOError, ValueError) as e:
+            logging.warning("Discarding corrupted cache entry '%s': %s.",
+                            path, e)
+            os.remove(path)
+            return None
+
+    def _saveToDisk(self, key, features):
+        if self._path is None:
+            return
+        path = self._diskPath(key)
+        try:
+            if not os.path.exists(os.path.dirname(path)):
+                self._evictStaleVersions(key)
+                os.makedirs(os.path.dirname(path))
+            tmpPath = "%s.%s.tmp" % (path, uuid.uuid4().hex)
+            with open(tmpPath, "wb") as f:
+                np.save(f, features)
+            os.rename(tmpPath, path)
+        except (IOError, os.error) as e:
+            logging.warning("Couldn't store cache entry '%s': %s.", path, e)
+
+    def _evictStaleVersions(self, key):
+        owner, technique, techniqueKey, _ = key
+        techniquePath = os.path.join(self._path, owner, technique)
+        if not os.path.isdir(techniquePath):
+            return
+        for name in os.listdir(techniquePath):
+            if name != techniqueKey:
+                shutil.rmtree(os.path.join(techniquePath, name),
+                              ignore_errors=True)
+        with self._lock:
+            for k in [k for k in self._entries if k[:2] == key[:2] and \
+                    k[2] != techniqueKey]:
+                self._memoryUsage -= self._entries.pop(k).nbytes
+
+    def purge(self, owner):
+        # drops all the entries of 'owner', e.g. a deleted enrollment
+        with self._lock:
+            for k in [k for k in self._entries if k[0] == owner]:
+                self._memoryUsage -= self._entries.pop(k).nbytes
+        if self._path is not None:
+            shutil.rmtree(os.path.join(self._path, owner), ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._memoryUsage = 0
\ No newline at end of file
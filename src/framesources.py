@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+
+import abc
+import cv
+import cv2
+import glob
+import numpy as np
+import os
+import time
+
+
+__all__ = ["FrameSource",
+           "CameraSource",
+           "VideoFileSource",
+           "ImageFolderSource",
+           "SyntheticSource",
+           "CachedFrameSource",
+           "frameSourceFromSpec"]
+
+
+class FrameSource(object):
+
+    __metaclass__ = abc.ABCMeta
+
+    _DEFAULT_FPS = 30
+
+    def __init__(self, realTime=True):
+        # recorded sources are paced to their fps in real time mode and
+        # replayed as fast as possible otherwise; live sources pace themselves
+        self.realTime = realTime
+        self._lastReadTime = None
+        self._finished = False
+
+    @property
+    def live(self):
+        return False
+
+    @property
+    def finished(self):
+        return self._finished
+
+    @abc.abstractproperty
+    def fps(self):
+        pass
+
+    @abc.abstractproperty
+    def frameSize(self):
+        pass
+
+    @abc.abstractmethod
+    def _read(self):
+        pass
+
+    def read(self):
+        # returns a BGR frame, or None when there are no more frames
+        if self._finished:
+            return None
+        if self.realTime and not self.live and \
+                self._lastReadTime is not None:
+            delay = self._lastReadTime + 1. / self.fps - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        self._lastReadTime = time.time()
+        frame = self._read()
+        if frame is None and not self.live:
+            self._finished = True
+        return frame
+
+    def rewind(self):
+        self._finished = False
+        self._lastReadTime = None
+
+    def release(self):
+        pass
+
+
+class _CaptureSource(FrameSource):
+
+    def __init__(self, capture, name, realTime=True):
+        super(_CaptureSource, self).__init__(realTime)
+        self._capture = capture
+        if not self._capture.isOpened():
+            raise IOError("Could not open '%s'." % name)
+
+    @property
+    def fps(self):
+        fps = int(self._capture.get(cv.CV_CAP_PROP_FPS))
+        if not fps > 0:
+            fps = self._DEFAULT_FPS
+        return fps
+
+    @property
+    def frameSize(self):
+        w = self._capture.get(cv.CV_CAP_PROP_FRAME_WIDTH)
+        h = self._capture.get(cv.CV_CAP_PROP_FRAME_HEIGHT)
+        return int(w), int(h)
+
+    @frameSize.setter
+    def frameSize(self, newSize):
+        w, h = newSize
+        self._capture.set(cv.CV_CAP_PROP_FRAME_WIDTH, w)
+        self._capture.set(cv.CV_CAP_PROP_FRAME_HEIGHT, h)
+
+    def _read(self):
+        _, frame = self._capture.read()
+        return frame
+
+    def release(self):
+        self._capture.release()
+
+
+class CameraSource(_CaptureSource):
+
+    def __init__(self, cameraId=0):
+        super(CameraSource, self).__init__(cv2.VideoCapture(cameraId),
+                                           "camera %d" % cameraId)
+
+    @property
+    def live(self):
+        return True
+
+
+class VideoFileSource(_CaptureSource):
+
+    def __init__(self, path, realTime=True):
+        self._path = path
+        super(VideoFileSource, self).__init__(cv2.VideoCapture(path), path,
+                                              realTime)
+
+    def rewind(self):
+        super(VideoFileSource, self).rewind()
+        self._capture.set(cv.CV_CAP_PROP_POS_FRAMES, 0)
+
+
+class ImageFolderSource(FrameSource):
+
+    _EXTENSIONS = ("bmp", "jpg", "jpeg", "png", "pgm", "ppm", "tif", "tiff")
+
+    def __init__(self, path, fps=None, realTime=True):
+        super(ImageFolderSource, self).__init__(realTime)
+        self._filenames = sorted(f for f in glob.glob(os.path.join(path,
+            "*")) if os.path.splitext(f)[1][1:].lower() in self._EXTENSIONS)
+        if not self._filenames:
+            raise IOError("No images found in '%s'." % path)
+        self._fps = fps or self._DEFAULT_FPS
+        first = cv2.imread(self._filenames[0])
+        if first is None:
+            raise IOError("Could not read '%s'." % self._filenames[0])
+        self._frameSize = first.shape[1], first.shape[0]
+        self._next = 0
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @property
+    def frameSize(self):
+        return self._frameSize
+
+    def _read(self):
+        while self._next < len(self._filenames):
+            frame = cv2.imread(self._filenames[self._next])
+            self._next += 1
+            if frame is not None:
+                return frame
+        return None
+
+    def rewind(self):
+        super(ImageFolderSource, self).rewind()
+        self._next = 0
+
+
+class SyntheticSource(FrameSource):
+
+    def __init__(self, frameSize=(640, 480), fps=None, frames=None, faces=1,
+                 seed=0, realTime=True):
+        super(SyntheticSource, self).__init__(realTime)
+        self._frameSize = tuple(frameSize)
+        self._fps = fps or self._DEFAULT_FPS
+        self._frames = frames
+        self._faces = faces
+        self._seed = seed
+        self.rewind()
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @property
+    def frameSize(self):
+        return self._frameSize
+
+    def rewind(self):
+        super(SyntheticSource, self).rewind()
+        # the same seed always generates the same sequence
+        self._random = np.random.RandomState(self._seed)
+        w, h = self._frameSize
+        self._background = self._random.randint(0, 64, (h, w, 3)).astype( \
+            np.uint8)
+        self._positions = self._random.rand(self._faces, 2) * (w, h)
+        self._velocities = (self._random.rand(self._faces, 2) - 0.5) * 8
+        self._count = 0
+
+    def _read(self):
+        if self._frames is not None and self._count >= self._frames:
+            return None
+        self._count += 1
+        w, h = self._frameSize
+        frame = self._background.copy()
+        faceDim = min(w, h) // 4
+        self._positions = (self._positions + self._velocities) % (w, h)
+        for x, y in self._positions.astype(int):
+            center = (int(x), int(y))
+            cv2.ellipse(frame, center, (faceDim*3/8, faceDim/2), 0, 0, 360,
+                        (150, 170, 200), -1)
+            for dx in (-faceDim/6, faceDim/6):
+                cv2.circle(frame, (center[0] + dx, center[1] - faceDim/8),
+                           faceDim/16, (40, 40, 40), -1)
+            cv2.line(frame, (center[0] - faceDim/8, center[1] + faceDim/5),
+                     (center[0] + faceDim/8, center[1] + faceDim/5),
+                     (60, 60, 120), 2)
+        return frame
+
+
+class CachedFrameSource(FrameSource):
+
+    def __init__(self, source, maxFrames=None, loop=True, realTime=None):
+        # decodes the frames of another source upfront, so replaying them
+        # costs no decoding nor disk access
+        super(CachedFrameSource, self).__init__(source.realTime if \
+            realTime is None else realTime)
+        self._fps = source.fps
+        self._frameSize = source.frameSize
+        # read without the source pacing, whose setting is left to its owner
+        self._frames = []
+        while maxFrames is None or len(self._frames) < maxFrames:
+            frame = source._read()
+            if frame is None:
+                break
+            self._frames.append(frame)
+        if not self._frames:
+            raise IOError("The cached source has no frames.")
+        self._loop = loop
+        self._next = 0
+
+    @property
+    def fps(self):
+        return self._fps
+
+    @property
+    def frameSize(self):
+        return self._frameSize
+
+    def __len__(self):
+        return len(self._frames)
+
+    def _read(self):
+        if self._next >= len(self._frames):
+            if not self._loop:
+                return None
+            self._next = 0
+        frame = self._frames[self._next]
+        self._next += 1
+        return frame
+
+    def rewind(self):
+        super(CachedFrameSource, self).rewind()
+        self._next = 0
+
+
+def frameSourceFromSpec(spec, realTime=True):
+    # 'camera[:id]', 'video:<path>', 'images:<dir>' or 'synthetic[:WxH]'
+    kind, _, arg = spec.partition(":")
+    if kind == "camera":
+        return CameraSource(int(arg or 0))
+    if kind == "video":
+        return VideoFileSource(arg, realTime)
+    if kind == "images":
+        return ImageFolderSource(arg, realTime=realTime)
+    if kind == "synthetic":
+        size = tuple(int(d) for d in arg.split("x")) if arg else (640, 480)
+        return SyntheticSource(size, realTime=realTime)
+    raise ValueError("Unknown frame source '%s'." % spec)
\ No newline at end of file
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import json
+import numpy as np
+import os
+import threading
+
+
+__all__ = ["Gallery",
+           "normalizeFace"]
+
+
+def normalizeFace(frame, bbox, faceSize):
+    x, y, w, h = bbox
+    face = cv2.resize(frame[y:y + h, x:x + w], faceSize)
+    return cv2.equalizeHist(face)
+
+
+class Gallery(object):
+
+    _INDEX_FILENAME = "gallery.idx"
+    _DATA_FILENAME = "gallery.dat"
+    _MIN_CAPACITY = 1024
+
+    def __init__(self, path, faceSize=(64, 64)):
+        self._path = path
+        self._lock = threading.RLock()
+
+        try:
+            if not os.path.exists(path):
+                os.makedirs(path)
+        except os.error as e:
+            raise IOError("%s: '%s'" % (e.strerror, e.filename))
+
+        self._faceSize = tuple(faceSize)
+        self._size = 0
+        self._records = {}
+        self._tombstones = []
+        if os.path.exists(self._indexPath):
+            self._loadIndex()
+        self._data = None
+        self._mapData()
+
+    @property
+    def _indexPath(self):
+        return os.path.join(self._path, self._INDEX_FILENAME)
+
+    @property
+    def _dataPath(self):
+        return os.path.join(self._path, self._DATA_FILENAME)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def faceSize(self):
+        return self._faceSize
+
+    @property
+    def users(self):
+        return self._records.keys()
+
+    @property
+    def wastedFaces(self):
+        return sum(count for _, count in self._tombstones)
+
+    def __contains__(self, user):
+        return user in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def _loadIndex(self):
+        with open(self._indexPath, "rb") as f:
+            index = json.load(f)
+        self._faceSize = tuple(index["faceSize"])
+        self._size = index["size"]
+        self._records = dict((user, tuple(r)) for user, r in \
+            index["records"].iteritems())
+        self._tombstones = [tuple(t) for t in index["tombstones"]]
+
+    def _saveIndex(self):
+        index = {"faceSize": self._faceSize,
+                 "size": self._size,
+                 "records": self._records,
+                 "tombstones": self._tombstones}
+        tmpPath = self._indexPath + ".tmp"
+        with open(tmpPath, "wb") as f:
+            json.dump(index, f)
+        # replaces the previous index atomically
+        os.rename(tmpPath, self._indexPath)
+
+    def _mapData(self, minCapacity=0):
+        w, h = self._faceSize
+        faceBytes = w*h
+        capacity = 0
+        if os.path.exists(self._dataPath):
+            capacity = os.path.getsize(self._dataPath) / faceBytes
+        if capacity < max(minCapacity, self._size, 1):
+            # grows geometrically so appends are amortized O(1)
+            capacity = max(minCapacity, capacity*2, self._MIN_CAPACITY)
+            with open(self._dataPath, "ab") as f:
+                f.truncate(capacity*faceBytes)
+        if self._data is not None:
+            self._data.flush()
+        self._data = np.memmap(self._dataPath, dtype=np.uint8, mode="r+",
+                               shape=(capacity, h, w))
+
+    def getFaces(self, user):
+        with self._lock:
+            start, count = self._records[user]
+            return self._data[start:start + count]
+
+    def append(self, user, faces):
+        self.extend([(user, faces)])
+
+    def extend(self, usersFaces):
+        # appends the faces of many users, with a single index update
+        w, h = self._faceSize
+        with self._lock:
+            for user, faces in usersFaces:
+                faces = [f for f in faces if f.shape == (h, w)]
+                record = self._records.pop(user, None)
+                if record is not None:
+                    self._tombstones.append(record)
+                start = self._size
+                if start + len(faces) > self._data.shape[0]:
+                    self._mapData(start + len(faces))
+                for i, face in enumerate(faces):
+                    self._data[start + i] = face
+                self._size += len(faces)
+                self._records[user] = (start, len(faces))
+            self._data.flush()
+            self._saveIndex()
+
+    def enrollmentFaces(self, enrollment):
+        # the faces of an enrollment, as stored by the gallery
+        return enrollment.getProcessedFaces(lambda frame, bbox: \
+            normalizeFace(frame, bbox, self._faceSize))
+
+    def appendEnrollment(self, user, enrollment):
+        self.append(user, self.enrollmentFaces(enrollment))
+
+    def remove(self, user):
+        with self._lock:
+            record = self._records.pop(user, None)
+            if record is None:
+                return
+            self._tombstones.append(record)
+            self._saveIndex()
+
+    def compact(self):
+        with self._lock:
+            w, h = self._faceSize
+            tmpPath = self._dataPath + ".tmp"
+            records = {}
+            size = 0
+            with open(tmpPath, "wb") as f:
+                for user, (start, count) in sorted(self._records.iteritems(),
+                                                   key=lambda r: r[1][0]):
+                    self._data[start:start + count].tofile(f)
+                    records[user] = (size, count)
+                    size += count
+            self._data = None
+            os.remove(self._dataPath)
+            os.rename(tmpPath, self._dataPath)
+            self._size = size
+            self._records = records
+            self._tombstones = []
+            self._saveIndex()
+            self._mapData()
+
+
+def _main():
+    import sys
+    from utilities import getApplicationPath
+    path = sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.join(getApplicationPath(), "gallery")
+    gallery = Gallery(path)
+    wastedFaces = gallery.wastedFaces
+    gallery.compact()
+    print "Compacted '%s': %d faces reclaimed." % (path, wastedFaces)
+
+
+if __name__ == "__main__":
+    _main()
\ No newline at end of file
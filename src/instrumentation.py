@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import json
+import math
+import threading
+
+from utilities import StopWatch
+
+
+__all__ = ["LatencyHistogram",
+           "Instrumentation"]
+
+
+class LatencyHistogram(object):
+
+    # logarithmic buckets from 10 us up to half an hour, each one 10% wider
+    # than the previous; recording is a logarithm and an increment, and the
+    # percentiles are within 10% of the exact ones
+    _MIN_LATENCY = 1e-5
+    _GROWTH = 1.1
+    _BUCKETS = 200
+
+    def __init__(self):
+        self._counts = [0] * self._BUCKETS
+        self._count = 0
+        self._total = 0.
+        self._max = 0.
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        return self._total / self._count if self._count else 0.
+
+    @property
+    def max(self):
+        return self._max
+
+    def record(self, latency):
+        if latency > self._MIN_LATENCY:
+            i = int(math.log(latency / self._MIN_LATENCY, self._GROWTH)) + 1
+            i = min(i, self._BUCKETS - 1)
+        else:
+            i = 0
+        self._counts[i] += 1
+        self._count += 1
+        self._total += latency
+        self._max = max(self._max, latency)
+
+    def percentile(self, p):
+
+        assert p >= 0 and p <= 100, "'p' must be in [0, 100] interval."
+
+        if not self._count:
+            return 0.
+        # the upper bound of the bucket holding the p-th percentile
+        target = max(int(math.ceil(p / 100. * self._count)), 1)
+        accumulated = 0
+        for i, count in enumerate(self._counts):
+            accumulated += count
+            if accumulated >= target:
+                break
+        return min(self._MIN_LATENCY * self._GROWTH**i, self._max)
+
+
+class _Measurement(object):
+
+    def __init__(self, instrumentation, stage):
+        self._instrumentation = instrumentation
+        self._stage = stage
+
+    def __enter__(self):
+        self._stopWatch = StopWatch()
+
+    def __exit__(self, excType, excValue, traceback):
+        self._instrumentation.record(self._stage, self._stopWatch.elapsedTime)
+        return False
+
+
+class Instrumentation(object):
+
+    _PERCENTILES = (50, 95, 99)
+
+    def __init__(self):
+        # stages are recorded from the GUI, capture and recognition threads
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self.enabled = True
+
+    @property
+    def stages(self):
+        with self._lock:
+            return sorted(self._histograms)
+
+    def record(self, stage, latency):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram()
+            histogram.record(latency)
+
+    def measure(self, stage):
+        # usage: with instrumentation.measure("detection"): ...
+        return _Measurement(self, stage)
+
+    def report(self):
+        ret = {}
+        with self._lock:
+            for stage, histogram in self._histograms.iteritems():
+                summary = {"count": histogram.count,
+                           "mean": histogram.mean,
+                           "max": histogram.max}
+                for p in self._PERCENTILES:
+                    summary["p%d" % p] = histogram.percentile(p)
+                ret[stage] = summary
+        return ret
+
+    def dump(self, path):
+        with open(path, "wb") as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+def _main():
+    import random
+    instrumentation = Instrumentation()
+    for _ in xrange(10000):
+        instrumentation.record("uniform", random.uniform(0.01, 0.02))
+        with instrumentation.measure("empty"):
+            pass
+    for stage, summary in sorted(instrumentation.report().iteritems()):
+        print "%s: p50 %.2f ms, p95 %.2f ms, p99 %.2f ms" % (stage,
+            summary["p50"]*1e3, summary["p95"]*1e3, summary["p99"]*1e3)
+
+
+if __name__ == "__main__":
+    _main()
\ No newline at end of file
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+
+import _multiprocessing
+import fcntl
+import itertools
+import logging
+import mmap
+import numpy as np
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+
+from gallery import Gallery
+from plugin import Plugin
+
+
+__all__ = ["IsolatedTechnique"]
+
+
+# methods receiving a frame, which travels through the shared memory ring
+_FRAME_METHODS = ("identify", "identifyBatch", "scores")
+# methods changing the model, replayed on a restarted worker
+_MODEL_METHODS = ("setup", "train", "loadState", "addUser", "removeUser")
+
+
+class _WorkerFailure(Exception):
+    pass
+
+
+class _CallTimedOut(Exception):
+    pass
+
+
+def _unpackFrame(frames, slotSize, spec):
+    if spec[0] == "array":
+        return spec[1]
+    # a view of the slot, valid until the call returns
+    _, slot, shape = spec
+    return np.frombuffer(frames, np.uint8, int(np.prod(shape)),
+                         slot*slotSize).reshape(shape)
+
+
+def _serve(pluginInfo, galleryPath, galleryFaceSize, conn, frames, slotSize):
+    # the worker process main loop: one request, one reply, plus the
+    # progress messages of a training; replies carry the request id, so the
+    # late reply of a call given up by the main process is told apart
+    technique = pluginInfo.instantiate()
+    callId = None
+    technique._trainingProgressCallback = lambda p: conn.send((callId,
+        "progress", p))
+    while True:
+        try:
+            callId, method, args = conn.recv()
+        except (EOFError, IOError):
+            break
+        try:
+            if method in ("name", "featuresKey"):
+                ret = getattr(technique, method)
+            else:
+                if method in _FRAME_METHODS:
+                    args = (_unpackFrame(frames, slotSize, args[0]),) + \
+                        args[1:]
+                # the gallery is changed by the main process, so it's mapped
+                # again before the model uses it
+                if galleryPath is not None and method in _MODEL_METHODS:
+                    technique.gallery = Gallery(galleryPath, galleryFaceSize)
+                ret = getattr(technique, method)(*args)
+            reply = callId, "result", ret
+        except Exception as e:
+            reply = callId, "error", e
+        try:
+            conn.send(reply)
+        except Exception as e:
+            # the exception itself may not be picklable
+            conn.send((callId, "error", RuntimeError("%s: %s" % \
+                (type(e).__name__, e))))
+        if method == "teardown":
+            break
+
+
+def _workerMain():
+    # the worker runs in a fresh interpreter, so it inherits neither the
+    # threads nor the locks held by the main process; it gets a socket and
+    # then its configuration through it
+    conn = _multiprocessing.Connection(int(sys.argv[1]))
+    pluginInfo, galleryPath, galleryFaceSize, framesPath, slotSize = \
+        conn.recv()
+    with open(framesPath, "r+b") as f:
+        frames = mmap.mmap(f.fileno(), 0)
+    _serve(pluginInfo, galleryPath, galleryFaceSize, conn, frames, slotSize)
+
+
+class IsolatedTechnique(Plugin):
+
+    # a technique running in its own worker process, with the Plugin
+    # interface; frames are copied into a shared memory ring instead of being
+    # pickled, and identification calls time out, dropping their result. A
+    # crashed worker is restarted and brought back to the same model, and
+    # 'onFailure(technique, error)' is called once it can't be
+    _MAX_RESTARTS = 3
+    _RESTART_TIMEOUT = 30
+
+    def __init__(self, pluginInfo, gallery=None, callTimeout=1., slots=2,
+                 slotSize=1920*1080, onFailure=None):
+
+        assert callTimeout > 0, "'callTimeout' must be > 0."
+        assert slots > 0, "'slots' must be > 0."
+        assert slotSize > 0, "'slotSize' must be > 0."
+
+        self._pluginInfo = pluginInfo
+        self.gallery = gallery
+        self._callTimeout = callTimeout
+        self._slots = slots
+        self._slotSize = slotSize
+        self._onFailure = onFailure
+        # the ring is a file mapped by both processes, preferably in memory
+        shmPath = "/dev/shm" if os.path.isdir("/dev/shm") else None
+        fd, self._framesPath = tempfile.mkstemp(prefix="technique",
+                                                dir=shmPath)
+        try:
+            os.ftruncate(fd, slots*slotSize)
+            self._frames = mmap.mmap(fd, slots*slotSize)
+        finally:
+            os.close(fd)
+        self._freeSlots = None
+        # the slots of the timed out calls, freed when their reply arrives
+        self._pendingSlots = {}
+        self._callIds = itertools.count()
+        self._lock = threading.RLock()
+        self._process = None
+        self._conn = None
+        self._ready = False
+        self._restarting = False
+        self._tornDown = False
+        self._history = []
+        self._restarts = 0
+        self._error = None
+
+        try:
+            self._startWorker()
+            self._name = self._request("name", (), self._RESTART_TIMEOUT)
+            self._featuresKey = self._request("featuresKey", (),
+                                              self._RESTART_TIMEOUT)
+        except Exception:
+            self.teardown()
+            raise
+        self._ready = True
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def featuresKey(self):
+        return self._featuresKey
+
+    @property
+    def error(self):
+        # why the worker was given up, None while it's serviceable
+        return self._error
+
+    def _startWorker(self):
+        conn, childConn = socket.socketpair()
+        galleryPath = self.gallery.path if self.gallery is not None else None
+        galleryFaceSize = self.gallery.faceSize if self.gallery is not None \
+            else None
+        try:
+            # the workers started later must not keep this end open, or this
+            # one wouldn't see the main process going away
+            fcntl.fcntl(conn.fileno(), fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+            self._conn = _multiprocessing.Connection(os.dup(conn.fileno()))
+            fcntl.fcntl(self._conn.fileno(), fcntl.F_SETFD, fcntl.FD_CLOEXEC)
+            self._process = subprocess.Popen([sys.executable,
+                os.path.splitext(os.path.abspath(__file__))[0] + ".py",
+                str(childConn.fileno())], close_fds=False)
+        finally:
+            conn.close()
+            childConn.close()
+        self._conn.send((self._pluginInfo, galleryPath, galleryFaceSize,
+                         self._framesPath, self._slotSize))
+        self._freeSlots = range(self._slots)
+        self._pendingSlots = {}
+
+    def _stopWorker(self):
+        self._ready = False
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.terminate()
+            self._process.wait()
+            self._process = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _collectLateReply(self, timeout):
+        if not self._conn.poll(timeout):
+            return
+        slot = self._pendingSlots.pop(self._conn.recv()[0], None)
+        if slot is not None:
+            self._freeSlots.append(slot)
+
+    def _packFrame(self, frame):
+        frame = np.ascontiguousarray(frame)
+        if frame.dtype != np.uint8 or frame.nbytes > self._slotSize:
+            return ("array", frame), None
+        # the slots are all held by timed out calls; waiting for one at most
+        # 'callTimeout' bounds the calls piling up behind a slow worker
+        if not self._freeSlots:
+            self._collectLateReply(self._callTimeout)
+        if not self._freeSlots:
+            raise _CallTimedOut("the worker is overloaded")
+        slot = self._freeSlots.pop()
+        np.frombuffer(self._frames, np.uint8, frame.size,
+                      slot*self._slotSize).reshape(frame.shape)[...] = frame
+        return ("slot", slot, frame.shape), slot
+
+    def _request(self, method, args, timeout):
+        with self._lock:
+            if self._conn is None:
+                raise _WorkerFailure("the worker isn't running")
+            slot = None
+            try:
+                if method in _FRAME_METHODS:
+                    spec, slot = self._packFrame(args[0])
+                    args = (spec,) + args[1:]
+                callId = next(self._callIds)
+                self._conn.send((callId, method, args))
+                while True:
+                    if not self._conn.poll(timeout):
+                        # the worker may still read the frame, so the slot
+                        # waits for the late reply
+                        if slot is not None:
+                            self._pendingSlots[callId] = slot
+                            slot = None
+                        raise _CallTimedOut("'%s' timed out" % method)
+                    replyId, kind, value = self._conn.recv()
+                    if replyId != callId:
+                        # the late reply of a timed out call
+                        lateSlot = self._pendingSlots.pop(replyId, None)
+                        if lateSlot is not None:
+                            self._freeSlots.append(lateSlot)
+                        continue
+                    if kind != "progress":
+                        break
+                    # raises TrainingCanceled when the training is stale
+                    self.reportTrainingProgress(value)
+            except (EOFError, IOError) as e:
+                slot = None
+                e = _WorkerFailure("the worker died: %s" % e)
+                self._onWorkerFailure(e)
+                raise e
+            except _CallTimedOut:
+                raise
+            except Exception:
+                # the worker is left in an unknown state
+                slot = None
+                self._stopWorker()
+                raise
+            finally:
+                if slot is not None:
+                    self._freeSlots.append(slot)
+        if kind == "error":
+            raise value
+        return value
+
+    def _onWorkerFailure(self, e):
+        logging.warning("The '%s' technique worker failed: %s.",
+                        self._pluginInfo.name, e)
+        self._stopWorker()
+        # only a model being served is worth bringing back
+        if self._tornDown or not any(m in ("train", "loadState") for m, _ \
+                in self._history):
+            return
+        if self._restarts >= self._MAX_RESTARTS:
+            logging.warning("Giving up restarting the '%s' technique worker.",
+                            self._pluginInfo.name)
+            self._fail(e)
+            return
+        self._restarts += 1
+        self._restarting = True
+        restarter = threading.Thread(target=self._restart,
+                                     name="TechniqueRestart")
+        restarter.daemon = True
+        restarter.start()
+
+    def _restart(self):
+        # the lock is taken per replayed call, so the model changes made in
+        # the meantime only extend the history being replayed
+        try:
+            with self._lock:
+                if self._tornDown:
+                    return
+                self._startWorker()
+            i = 0
+            while True:
+                with self._lock:
+                    if self._tornDown:
+                        return
+                    if i == len(self._history):
+                        self._restarting = False
+                        self._ready = True
+                        return
+                    method, args = self._history[i]
+                    self._request(method, args, None)
+                i += 1
+        except _WorkerFailure:
+            # a restart is already handled by the failure
+            return
+        except Exception as e:
+            logging.warning("Couldn't restore the '%s' technique worker: %s.",
+                            self._pluginInfo.name, e)
+            with self._lock:
+                self._stopWorker()
+            self._fail(e)
+
+    def _fail(self, e):
+        self._restarting = False
+        self._error = e
+        if self._onFailure is not None:
+            self._onFailure(self, e)
+
+    def _call(self, method, *args):
+        with self._lock:
+            if self._error is not None:
+                raise _WorkerFailure(self._error)
+            if not self._restarting:
+                ret = self._request(method, args, None)
+            else:
+                # the replay applies it
+                ret = None
+            self._history.append((method, args))
+            return ret
+
+    def setup(self):
+        self._call("setup")
+
+    def teardown(self):
+        self._tornDown = True
+        with self._lock:
+            if self._ready:
+                try:
+                    self._request("teardown", (), self._callTimeout)
+                except Exception as e:
+                    logging.warning("Couldn't tear the '%s' technique down: "
+                                    "%s.", self._pluginInfo.name, e)
+            self._stopWorker()
+            self._frames.close()
+            try:
+                os.remove(self._framesPath)
+            except os.error:
+                pass
+
+    def train(self, users):
+        # a model trained from scratch makes the previous changes moot
+        self._history = [h for h in self._history if h[0] == "setup"]
+        self._call("train", users)
+
+    def saveState(self, path):
+        self._request("saveState", (path,), None)
+
+    def loadState(self, path):
+        self._history = [h for h in self._history if h[0] == "setup"]
+        self._call("loadState", path)
+
+    def addUser(self, user, enrollment):
+        self._call("addUser", user, enrollment)
+
+    def removeUser(self, user):
+        self._call("removeUser", user)
+
+    def _identify(self, method, frame, *args):
+        if not self._ready:
+            return None
+        try:
+            ret = self._request(method, (frame,) + args, self._callTimeout)
+        except (_WorkerFailure, _CallTimedOut):
+            return None
+        self._restarts = 0
+        return ret
+
+    def identify(self, frame, bbox, securityTol):
+        ret = self._identify("identify", frame, bbox, securityTol)
+        return ret if ret is not None else (0, None)
+
+    def identifyBatch(self, frame, bboxes, securityTol):
+        ret = self._identify("identifyBatch", frame, bboxes, securityTol)
+        return ret if ret is not None else [(0, None)] * len(bboxes)
+
+    def scores(self, frame, bbox):
+        ret = self._identify("scores", frame, bbox)
+        return ret if ret is not None else {}
+
+
+if __name__ == "__main__":
+    _workerMain()
\ No newline at end of file
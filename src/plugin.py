@@ -1,76 +1,197 @@
 # -*- coding: utf-8 -*-
 
 import abc
+import ast
+import hashlib
 import imp
+import json
 import logging
+import os
 import pkgutil
-import pyclbr
 
 
-__all__ = ["Plugin"]
+__all__ = ["Plugin",
+           "PluginInfo",
+           "TrainingCanceled"]
+
+
+# imported plugin modules, by file path and modification time
+_modules = {}
+
+
+def _sourcePathOf(pathname, desc):
+    # the file holding the module, and whether it's source code
+    if desc[2] == imp.PKG_DIRECTORY:
+        return os.path.join(pathname, "__init__.py"), True
+    return pathname, desc[2] == imp.PY_SOURCE
+
+
+def _readSource(pathname):
+    with open(pathname, "rb") as f:
+        return f.read()
+
+
+def _classesDerivingPlugin(source):
+    # a cheap static test, so modules that can't define plugins are never
+    # imported; a class deriving Plugin through a base of another module
+    # isn't caught, which is OK for the scope of this application
+    tree = ast.parse(source)
+    classes = [n for n in tree.body if isinstance(n, ast.ClassDef)]
+    derived = set([Plugin.__name__])
+    changed = True
+    while changed:
+        changed = False
+        for c in classes:
+            bases = set(b.id if isinstance(b, ast.Name) else b.attr for b in \
+                c.bases if isinstance(b, (ast.Name, ast.Attribute)))
+            if c.name not in derived and bases & derived:
+                derived.add(c.name)
+                changed = True
+    return [c.name for c in classes if c.name in derived]
+
+
+def _importModule(name, path):
+    fid, pathname, desc = imp.find_module(name, [path])
+    try:
+        key = pathname, os.path.getmtime(pathname)
+        module = _modules.get(key)
+        if module is None:
+            module = _modules[key] = imp.load_module(name, fid, pathname,
+                                                     desc)
+        return module
+    finally:
+        if fid:
+            fid.close()
+
+
+def _analyzeModule(name, path, source):
+    # the plugin classes of a module, as (class name, technique name) pairs;
+    # the names are properties, so the classes are instantiated once here
+    try:
+        classesNames = _classesDerivingPlugin(source) if source is not \
+            None else None
+        if classesNames == []:
+            return []
+        module = _importModule(name, path)
+    except Exception as e:
+        logging.warning("Couldn't fully load plugin mod. '%s': %s.", name, e)
+        return []
+    if classesNames is None:
+        classesNames = sorted(n for n, c in vars(module).iteritems() if \
+            isinstance(c, type) and issubclass(c, Plugin) and \
+            c.__module__ == module.__name__)
+    ret = []
+    for className in classesNames:
+        try:
+            techniqueName = getattr(module, className)().name
+        except Exception as e:
+            logging.warning("Couldn't instantiate plugin class '%s': %s.",
+                            className, e)
+            continue
+        ret.append((className, techniqueName))
+    return ret
 
 
-def _getAllClassesNames(clbrAnalysis):
-    ret = set()
-    for c in clbrAnalysis:
-        if isinstance(c, pyclbr.Class):
-            ret.add(c.name)
-            ret.union(_getAllClassesNames(c.super))
-    return ret
+class PluginInfo(object):
 
-def _isAPluginModule(modName, path):
-    # ==========================================================================
-    # CAUTION: UNSAFE AND UGLY CODE
-    # unfortunately this is needed to overpass the pyclbr cache and allow
-    # checking of changed modules =/
-    reload(pyclbr)
-    # ==========================================================================
-    superclassesInMod = reduce(set.union, (_getAllClassesNames(c.super) \
-        for c in pyclbr.readmodule(modName, path).values()))
-    # I know... this is not a very comprehensive and secure test because the
-    # class name is not a unique identifier... but for the scope of this
-    # application, it's completely OK
-    return Plugin.__name__ in superclassesInMod
+    def __init__(self, name, moduleName, className, path):
+        self.name = name
+        self.moduleName = moduleName
+        self.className = className
+        self.path = path
 
+    def load(self):
+        # the module is imported on the first use only
+        return getattr(_importModule(self.moduleName, self.path),
+                       self.className)
 
-class _PluginMeta(abc.ABCMeta):
+    def instantiate(self):
+        return self.load()()
 
-    def __init__(self, name, bases, attrs):
-        super(_PluginMeta, self).__init__(name, bases, attrs)
-        if not hasattr(self, "_registered"):
-            self._registered = []
-        else:
-            self._registered.append(self)
+
+class TrainingCanceled(Exception):
+    pass
 
 
 class Plugin(object):
 
-    __metaclass__ = _PluginMeta
+    __metaclass__ = abc.ABCMeta
 
-    @classmethod
-    def load(cls, *paths):
-        paths = list(paths)
-        cls._registered = []
-        for _, name, _ in pkgutil.iter_modules(paths):
-            if _isAPluginModule(name, paths):
-                fid, pathname, desc = imp.find_module(name, paths)
-                try:
-                    imp.load_module(name, fid, pathname, desc)
-                except Exception as e:
-                    logging.warning("Couldn't fully load plugin mod. '%s': %s.",
-                                    pathname, e.message)
-                if fid:
-                    fid.close()
+    # a gallery.Gallery holding the normalized faces of every user, set by
+    # FaceRecognizer when it has one; techniques may slice it per user
+    # instead of processing the enrollments by themselves
+    gallery = None
+
+    # cached processed faces are invalidated by bumping the version or by
+    # changing the parameters of a technique
+    version = "0"
+
+    @property
+    def params(self):
+        return {}
+
+    @property
+    def featuresKey(self):
+        cls = type(self)
+        return "%s.%s:%s:%r" % (cls.__module__, cls.__name__, self.version,
+                                sorted(self.params.items()))
 
     @classmethod
-    def getInstances(cls):
+    def discover(cls, path, manifestPath=None):
+        # the plugins of a directory, without importing them when the cached
+        # manifest has an entry for an unchanged module; a module changed only
+        # when its content hash did, a touched file is just revalidated
+        manifest = {}
+        if manifestPath is not None and os.path.exists(manifestPath):
+            try:
+                with open(manifestPath, "rb") as f:
+                    manifest = json.load(f)
+            except ValueError as e:
+                logging.warning("Ignoring the corrupt plugins manifest '%s': "
+                                "%s.", manifestPath, e)
+        newManifest = {}
         ret = []
-        for p in cls._registered:
+        for _, moduleName, _ in pkgutil.iter_modules([path]):
+            fid, pathname, desc = imp.find_module(moduleName, [path])
+            if fid:
+                fid.close()
+            pathname, isSource = _sourcePathOf(os.path.abspath(pathname),
+                                               desc)
+            # the source is read only when the file doesn't look unchanged
+            stat = os.stat(pathname)
+            entry = manifest.get(pathname)
+            if entry is None or entry["mtime"] != stat.st_mtime or \
+                    entry["size"] != stat.st_size:
+                source = _readSource(pathname) if isSource else None
+                sourceHash = hashlib.sha1(source).hexdigest() if source \
+                    is not None else None
+                if entry is None or sourceHash is None or \
+                        entry["sha1"] != sourceHash:
+                    entry = {"sha1": sourceHash,
+                             "classes": _analyzeModule(moduleName, path,
+                                                       source)}
+                else:
+                    # the cached entry is updated on a copy, or the manifest
+                    # wouldn't look changed and the new stat wouldn't be saved
+                    entry = dict(entry)
+                entry["mtime"] = stat.st_mtime
+                entry["size"] = stat.st_size
+            newManifest[pathname] = entry
+            for className, techniqueName in entry["classes"]:
+                ret.append(PluginInfo(techniqueName, moduleName, className,
+                                      path))
+
+        if manifestPath is not None and newManifest != manifest:
+            # written aside and renamed, so a concurrent start never reads
+            # half of it
+            tmpPath = manifestPath + ".tmp"
             try:
-                ret.append(p())
-            except TypeError as e:
-                logging.warning("Couldn't instantiate plugin class '%s': %s.",
-                                p.__name__, e.message)
+                with open(tmpPath, "wb") as f:
+                    json.dump(newManifest, f)
+                os.rename(tmpPath, manifestPath)
+            except (IOError, os.error) as e:
+                logging.warning("Couldn't save the plugins manifest '%s': "
+                                "%s.", manifestPath, e)
         return ret
 
     @abc.abstractproperty
@@ -89,6 +210,41 @@ class Plugin(object):
     def train(self, users):
         pass
 
+    def saveState(self, path):
+        # optional snapshot of a trained model into the 'path' directory; it
+        # lets FaceRecognizer restore the model instead of training it again
+        raise NotImplementedError()
+
+    def loadState(self, path):
+        raise NotImplementedError()
+
+    def reportTrainingProgress(self, progress):
+        # techniques may call this from 'train' to publish their progress in
+        # [0, 1]; it raises TrainingCanceled when the training became stale
+        callback = getattr(self, "_trainingProgressCallback", None)
+        if callback is not None:
+            callback(progress)
+
+    def addUser(self, user, enrollment):
+        # optional incremental update; the whole gallery is retrained through
+        # 'train' when it's not implemented
+        raise NotImplementedError()
+
+    def removeUser(self, user):
+        raise NotImplementedError()
+
     @abc.abstractmethod
     def identify(self, frame, bbox, securityTol):
-        pass
\ No newline at end of file
+        pass
+
+    def scores(self, frame, bbox):
+        # optional raw scores in [0, 1] of the face against every trained
+        # user, as a {user: score} dict; 'identify' is expected to accept the
+        # best scored user when its score is > 1 - securityTol, which lets
+        # every tolerance be evaluated from a single call
+        raise NotImplementedError()
+
+    def identifyBatch(self, frame, bboxes, securityTol):
+        # techniques able to match several faces against the gallery at once
+        # should override this
+        return [self.identify(frame, bbox, securityTol) for bbox in bboxes]
\ No newline at end of file
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
+import numpy as np
 import random
 
+from gallery import normalizeFace
 from plugin import Plugin
 
 
@@ -18,7 +20,26 @@ class Dummy(Plugin):
         pass
     
     def train(self, users):
-        self._users = users
+        self._users = dict(users)
+        # the mean gallery face of every user, scored against the probes
+        self._meanFaces = {}
+        for user in self._users:
+            self._addMeanFace(user)
+    
+    def _addMeanFace(self, user):
+        if self.gallery is None or user not in self.gallery:
+            return
+        faces = self.gallery.getFaces(user)
+        if len(faces):
+            self._meanFaces[user] = faces.mean(axis=0)
+    
+    def addUser(self, user, enrollment):
+        self._users[user] = enrollment
+        self._addMeanFace(user)
+    
+    def removeUser(self, user):
+        del self._users[user]
+        self._meanFaces.pop(user, None)
     
     def identify(self, frame, bbox, securityTol):
         user = None
@@ -26,6 +47,22 @@ class Dummy(Plugin):
         if self._users and confidence > 1 - securityTol:
             user = self._users.keys()[0]
         return confidence, user
+    
+    def scores(self, frame, bbox):
+        if not self._users:
+            return {}
+        if not self._meanFaces:
+            return {self._users.keys()[0]: random.random()}
+        face = normalizeFace(frame, bbox, self.gallery.faceSize)
+        return dict((user, 1 - np.abs(face - meanFace).mean() / 255) for \
+            user, meanFace in self._meanFaces.iteritems())
+    
+    def identifyBatch(self, frame, bboxes, securityTol):
+        confidences = np.random.random(len(bboxes))
+        accepted = confidences > 1 - securityTol
+        user = self._users.keys()[0] if self._users else None
+        return [(c, user if a else None) for c, a in zip(confidences, \
+            accepted)]
 
 
 class Dummy2(Plugin):
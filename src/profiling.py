@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+
+import cProfile
+import collections
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+
+
+__all__ = ["TechniqueProfiler"]
+
+
+class _Sampler(threading.Thread):
+
+    def __init__(self, profiler, interval):
+        super(_Sampler, self).__init__(name="ProfilerSampler")
+        self.daemon = True
+        self._profiler = profiler
+        self._interval = interval
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._profiler._sample()
+            time.sleep(self._interval)
+
+
+class TechniqueProfiler(object):
+
+    # 'deterministic' traces every function call through cProfile and is
+    # exported as pstats files; 'sampling' periodically snapshots the stacks
+    # of the threads inside a technique, which costs the technique almost
+    # nothing, and is exported as collapsed stacks for flame graphs
+    MODES = ("deterministic", "sampling")
+
+    def __init__(self, mode="deterministic", samplingInterval=0.001):
+
+        assert mode in self.MODES, "'mode' must be one of %s." % \
+            ", ".join(self.MODES)
+        assert samplingInterval > 0, "'samplingInterval' must be > 0."
+
+        self._mode = mode
+        self._samplingInterval = samplingInterval
+        self._lock = threading.Lock()
+        # cProfile profiles only the thread enabling it, so there is one
+        # profile per technique and thread, merged on export
+        self._profiles = {}
+        self._samples = {}
+        # thread id -> (technique name, frame calling the technique)
+        self._active = {}
+        self._sampler = None
+        self._enabled = False
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, e):
+        with self._lock:
+            self._enabled = e
+            if e and self._mode == "sampling" and self._sampler is None:
+                self._sampler = _Sampler(self, self._samplingInterval)
+                self._sampler.start()
+            elif not e and self._sampler is not None:
+                self._sampler.stop()
+                self._sampler = None
+
+    @property
+    def techniquesNames(self):
+        with self._lock:
+            return sorted(set(n for n, _ in self._profiles) | \
+                set(self._samples))
+
+    def call(self, techniqueName, f, *args, **kwargs):
+        if not self._enabled:
+            return f(*args, **kwargs)
+        thread = threading.current_thread().ident
+        if self._mode == "deterministic":
+            with self._lock:
+                profile = self._profiles.get((techniqueName, thread))
+                if profile is None:
+                    profile = self._profiles[techniqueName, thread] = \
+                        cProfile.Profile()
+            return profile.runcall(f, *args, **kwargs)
+
+        with self._lock:
+            nested = thread in self._active
+            if not nested:
+                self._active[thread] = techniqueName, sys._getframe()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if not nested:
+                with self._lock:
+                    del self._active[thread]
+
+    def _sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            active = self._active.items()
+        for thread, (techniqueName, callerFrame) in active:
+            frame = frames.get(thread)
+            stack = []
+            while frame is not None and frame is not callerFrame:
+                code = frame.f_code
+                stack.append("%s (%s:%d)" % (code.co_name,
+                    os.path.basename(code.co_filename), code.co_firstlineno))
+                frame = frame.f_back
+            # the technique returned in the meantime
+            if frame is None or not stack:
+                continue
+            with self._lock:
+                samples = self._samples.get(techniqueName)
+                if samples is None:
+                    samples = self._samples[techniqueName] = \
+                        collections.Counter()
+                samples[";".join(reversed(stack))] += 1
+
+    def stats(self, techniqueName):
+        with self._lock:
+            profiles = [p for (n, _), p in self._profiles.iteritems() if \
+                n == techniqueName]
+        if not profiles:
+            return None
+        ret = pstats.Stats(profiles[0])
+        for p in profiles[1:]:
+            ret.add(p)
+        return ret
+
+    def collapsedStacks(self, techniqueName):
+        with self._lock:
+            samples = dict(self._samples.get(techniqueName, {}))
+        return ["%s %d" % (stack, count) for stack, count in \
+            sorted(samples.iteritems())]
+
+    def export(self, path):
+        # one '<technique>.prof' pstats file and/or one '<technique>.folded'
+        # collapsed stacks file per profiled technique
+        try:
+            if not os.path.exists(path):
+                os.makedirs(path)
+        except os.error as e:
+            raise IOError("%s: '%s'" % (e.strerror, e.filename))
+        ret = []
+        for techniqueName in self.techniquesNames:
+            filename = os.path.join(path, re.sub(r"[^\w.-]+", "_",
+                                                 techniqueName))
+            stats = self.stats(techniqueName)
+            if stats is not None:
+                stats.dump_stats(filename + ".prof")
+                ret.append(filename + ".prof")
+            stacks = self.collapsedStacks(techniqueName)
+            if stacks:
+                with open(filename + ".folded", "wb") as f:
+                    f.write("\n".join(stacks) + "\n")
+                ret.append(filename + ".folded")
+        return ret
+
+    def reset(self):
+        with self._lock:
+            self._profiles = {}
+            self._samples = {}
\ No newline at end of file
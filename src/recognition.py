@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+from tracking import FaceTracker
+from utilities import ChangeDetector
+from utilities import FrameBundle
+from utilities import FrameRing
+from utilities import StopWatch
+
+
+__all__ = ["RecognitionWorker"]
+
+
+class RecognitionWorker(threading.Thread):
+
+    def __init__(self, faceDetector, faceRecognizer, tracking=True,
+                 detectionInterval=10, reverificationInterval=30,
+                 scheduler=None, instrumentation=None):
+        super(RecognitionWorker, self).__init__(name="Recognition")
+        self.daemon = True
+
+        self._faceDetector = faceDetector
+        self._faceRecognizer = faceRecognizer
+        self._scheduler = scheduler
+        self._instrumentation = instrumentation
+        self._reverificationInterval = reverificationInterval
+        self._changeDetector = ChangeDetector()
+        self._faceTracker = None
+        if tracking:
+            self._faceTracker = FaceTracker(self._detect, detectionInterval,
+                                            reverificationInterval)
+
+        # a single slot ring: frames that arrive while a recognition is in
+        # progress replace each other instead of being queued
+        self._frameRing = FrameRing(1)
+        self._resultsLock = threading.Lock()
+        self._results = []
+        self._processedFrames = 0
+        self._stopped = threading.Event()
+
+    @property
+    def results(self):
+        with self._resultsLock:
+            return list(self._results)
+
+    @property
+    def processedFrames(self):
+        return self._processedFrames
+
+    @property
+    def droppedFrames(self):
+        return self._frameRing.dropped
+
+    def submit(self, frame):
+        # 'frame' is a FrameBundle or a grayscale image
+        self._frameRing.push(frame)
+
+    def stop(self):
+        self._stopped.set()
+        self._frameRing.push(None)
+
+    def run(self):
+        while not self._stopped.is_set():
+            frame = self._frameRing.pop(None)
+            if frame is None:
+                continue
+            stopWatch = StopWatch()
+            grayFrame = frame.gray if isinstance(frame, FrameBundle) else \
+                frame
+            self._record("grayConversion", stopWatch.elapsedTime)
+            # the previous results are kept while the scene is static
+            if not self._changeDetector.changed(grayFrame):
+                continue
+            stopWatch = StopWatch()
+            if self._faceTracker is None:
+                results = self._recognize(frame, grayFrame)
+            else:
+                results = self._track(frame, grayFrame)
+            with self._resultsLock:
+                self._results = results
+                self._processedFrames += 1
+            if self._scheduler is not None:
+                cost = stopWatch.elapsedTime
+                self._scheduler.record("recognition", cost)
+                # under load the worker idles after each frame, so it's busy
+                # only for the level duty cycle
+                self._stopped.wait(cost*(1/self._scheduler.dutyCycle - 1))
+
+    def _record(self, stage, elapsedTime):
+        if self._instrumentation is not None:
+            self._instrumentation.record(stage, elapsedTime)
+
+    def _detect(self, frame, biggestObj):
+        # under load the scheduler lowers the detector resolution
+        sf = None
+        if self._scheduler is not None:
+            sf = self._faceDetector.subsamplingScaleFactor * \
+                self._scheduler.subsamplingFactor
+        stopWatch = StopWatch()
+        ret = self._faceDetector(frame, biggestObj, sf)
+        self._record("detection", stopWatch.elapsedTime)
+        return ret
+
+    def _identify(self, grayFrame, bboxes):
+        if len(bboxes) == 0:
+            return []
+        stopWatch = StopWatch()
+        ret = self._faceRecognizer.identifyMany(grayFrame, bboxes)
+        self._record("identification", stopWatch.elapsedTime)
+        return ret
+
+    def _recognize(self, frame, grayFrame):
+        bboxes = self._detect(frame, False)
+        identities = self._identify(grayFrame, bboxes)
+        return [(bbox, user, confidence) for bbox, (confidence, user) in \
+            zip(bboxes, identities)]
+
+    def _track(self, frame, grayFrame):
+        # each face is identified once per track, and identified again only
+        # on the tracker's re-verification schedule
+        if self._scheduler is not None:
+            self._faceTracker.reverificationInterval = \
+                self._reverificationInterval * \
+                self._scheduler.reverificationFactor
+        self._faceTracker.update(frame)
+        tracks = self._faceTracker.tracksToIdentify
+        identities = self._identify(grayFrame, [t.bbox for t in tracks])
+        for track, (confidence, user) in zip(tracks, identities):
+            self._faceTracker.setIdentity(track, user, confidence)
+        return [(t.bbox, t.user, t.confidence) for t in \
+            self._faceTracker.tracks]
\ No newline at end of file
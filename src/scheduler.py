@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+
+__all__ = ["LoadScheduler"]
+
+
+class LoadScheduler(object):
+
+    # degradation levels, from the full quality to the cheapest one:
+    # multiplier of the detector subsampling scale factor, multiplier of the
+    # identity re-verification interval and recognition duty cycle, the
+    # share of the time the recognition worker may be busy, which leaves
+    # the CPU to the capture and the display
+    _LEVELS = [(1., 1, 1.),
+               (.75, 1, 1.),
+               (.75, 2, .75),
+               (.5, 2, .75),
+               (.5, 4, .5),
+               (.5, 8, .33)]
+
+    def __init__(self, targetFps=25, latencyBudget=0.25, smoothing=0.1,
+                 patience=15):
+
+        assert targetFps > 0, "'targetFps' must be > 0."
+        assert latencyBudget > 0, "'latencyBudget' must be > 0."
+        assert smoothing > 0 and smoothing <= 1, \
+            "'smoothing' must be in (0, 1] interval."
+        assert patience > 0, "'patience' must be > 0."
+
+        self.targetFps = targetFps
+        self.latencyBudget = latencyBudget
+        self._smoothing = smoothing
+        self._patience = patience
+
+        self._lock = threading.Lock()
+        self._costs = {}
+        self._level = 0
+        # consecutive evaluations with too little or plenty of headroom;
+        # levels only change after 'patience' of them, which avoids flapping
+        self._overloaded = 0
+        self._underloaded = 0
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def maxLevel(self):
+        return len(self._LEVELS) - 1
+
+    @property
+    def subsamplingFactor(self):
+        return self._LEVELS[self._level][0]
+
+    @property
+    def reverificationFactor(self):
+        return self._LEVELS[self._level][1]
+
+    @property
+    def dutyCycle(self):
+        return self._LEVELS[self._level][2]
+
+    def record(self, stage, cost):
+        with self._lock:
+            previous = self._costs.get(stage)
+            self._costs[stage] = cost if previous is None else \
+                previous + self._smoothing*(cost - previous)
+
+    def stageCost(self, stage):
+        with self._lock:
+            return self._costs.get(stage, 0.)
+
+    @property
+    def stageCosts(self):
+        with self._lock:
+            return dict(self._costs)
+
+    def update(self):
+        # 'frame' is the interval between displayed frames and 'recognition'
+        # the processing cost of recognizing one of them, which is what the
+        # levels change
+        frameInterval = self.stageCost("frame")
+        recognitionCost = self.stageCost("recognition")
+        targetInterval = 1. / self.targetFps
+
+        if frameInterval > 1.1*targetInterval or \
+                recognitionCost > self.latencyBudget:
+            self._overloaded += 1
+            self._underloaded = 0
+        elif frameInterval < 1.05*targetInterval and \
+                recognitionCost < 0.5*self.latencyBudget:
+            self._underloaded += 1
+            self._overloaded = 0
+        else:
+            self._overloaded = self._underloaded = 0
+
+        if self._overloaded >= self._patience and self._level < self.maxLevel:
+            self._level += 1
+            self._overloaded = 0
+        elif self._underloaded >= self._patience and self._level > 0:
+            self._level -= 1
+            self._underloaded = 0
+        return self._level
\ No newline at end of file
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from utilities import Enroller
+from utilities import Enrollment
+
+
+class EnrollmentMigrationTest(unittest.TestCase):
+
+    _FRAMES = 3
+    _FRAME_SIZE = (64, 48)
+
+    def setUp(self):
+        self._basePath = Enroller._BASE_PATH
+        Enroller._BASE_PATH = tempfile.mkdtemp(prefix="enrollment")
+        self._id = "legacy"
+        legacyPath = os.path.join(Enroller._BASE_PATH, self._id)
+        os.makedirs(legacyPath)
+        w, h = self._FRAME_SIZE
+        for i in xrange(self._FRAMES):
+            frame = np.random.randint(0, 256, (h, w)).astype(np.uint8)
+            cv2.imwrite(os.path.join(legacyPath, "%d.%s" % \
+                (i, Enroller._LEGACY_SAMPLES_FORMAT)), frame)
+
+    def tearDown(self):
+        shutil.rmtree(Enroller._BASE_PATH, ignore_errors=True)
+        Enroller._BASE_PATH = self._basePath
+        Enrollment.faceDetector = None
+
+    def _assertMigrated(self):
+        self.assertFalse(os.path.exists(os.path.join(Enroller._BASE_PATH,
+                                                     self._id)))
+        self.assertTrue(os.path.exists(os.path.join(Enroller._BASE_PATH,
+            "%s.%s" % (self._id, Enroller._SAMPLES_FORMAT))))
+
+    def testMigratesTheWholeFrames(self):
+        enrollment = Enrollment(self._id)
+        faces = enrollment.getProcessedFaces(lambda crop, bbox: crop.shape)
+        self.assertEqual(faces, [self._FRAME_SIZE[::-1]] * self._FRAMES)
+        self.assertEqual(enrollment.bboxes,
+                         [(0, 0) + self._FRAME_SIZE] * self._FRAMES)
+        self._assertMigrated()
+
+    def testMigratesTheDetectedFaces(self):
+        face = 20, 10, 16, 16
+        Enrollment.faceDetector = staticmethod(lambda frame: [face])
+        enrollment = Enrollment(self._id)
+        bboxes = enrollment.getProcessedFaces(lambda crop, bbox: bbox)
+        self.assertEqual(bboxes, [(4, 4, 16, 16)] * self._FRAMES)
+        self.assertEqual(enrollment.bboxes, [face] * self._FRAMES)
+        self._assertMigrated()
+
+    def testMigratesTheKnownBBoxes(self):
+        Enrollment.faceDetector = staticmethod(lambda frame: [])
+        enrollment = Enrollment(self._id, [(8, 8, 24, 24)] * self._FRAMES)
+        self.assertEqual(len(enrollment.getProcessedFaces(lambda crop, bbox: \
+            bbox)), self._FRAMES)
+        self.assertEqual(enrollment.bboxes, [(8, 8, 24, 24)] * self._FRAMES)
+        self._assertMigrated()
+
+    def testMigratesEveryEnrollment(self):
+        # directories without numbered samples aren't enrollments
+        otherPath = os.path.join(Enroller._BASE_PATH, "other")
+        os.makedirs(otherPath)
+        self.assertEqual(Enrollment.migrateAll(), [self._id])
+        self._assertMigrated()
+        self.assertTrue(os.path.isdir(otherPath))
+        self.assertEqual(Enrollment.migrateAll(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from scheduler import LoadScheduler
+
+
+class LoadSchedulerTest(unittest.TestCase):
+
+    def _drive(self, scheduler, frameInterval, recognitionCost, updates):
+        for _ in xrange(updates):
+            scheduler.record("frame", frameInterval)
+            scheduler.record("recognition", recognitionCost)
+            scheduler.update()
+
+    def testDegradesUnderLoad(self):
+        scheduler = LoadScheduler(targetFps=30, latencyBudget=0.25,
+                                  patience=5)
+        self._drive(scheduler, 1./30, 1., 1000)
+        self.assertEqual(scheduler.level, scheduler.maxLevel)
+
+    def testRecoversFromTheTopLevel(self):
+        scheduler = LoadScheduler(targetFps=30, latencyBudget=0.25,
+                                  patience=5)
+        self._drive(scheduler, 1./30, 1., 1000)
+        self.assertEqual(scheduler.level, scheduler.maxLevel)
+        self._drive(scheduler, 1./30, 0.001, 5000)
+        self.assertEqual(scheduler.level, 0)
+
+    def testIdlesTheRecognitionUnderLoad(self):
+        scheduler = LoadScheduler(targetFps=30, latencyBudget=0.25,
+                                  patience=5)
+        self.assertEqual(scheduler.dutyCycle, 1)
+        self._drive(scheduler, 1./30, 1., 1000)
+        self.assertLess(scheduler.dutyCycle, 1)
+
+    def testHoldsTheLevelWithinTheBudget(self):
+        scheduler = LoadScheduler(targetFps=30, latencyBudget=0.25,
+                                  patience=5)
+        self._drive(scheduler, 1./30, 1., 1000)
+        # between half and the whole budget there is no reason to change
+        self._drive(scheduler, 1./30, 0.2, 1000)
+        self.assertEqual(scheduler.level, scheduler.maxLevel)
+
+
+if __name__ == "__main__":
+    unittest.main()
\ No newline at end of file
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+
+import cv2
+import itertools
+
+from utilities import FrameBundle
+from utilities import bboxOverlap
+
+
+__all__ = ["FaceTrack",
+           "FaceTracker"]
+
+
+class FaceTrack(object):
+
+    def __init__(self, id, bbox):
+        self.id = id
+        self.bbox = bbox
+        self.user = None
+        self.confidence = 0
+        # None means the track was never identified
+        self.framesSinceVerification = None
+        self._template = None
+
+
+class FaceTracker(object):
+
+    def __init__(self, faceDetector, detectionInterval=10,
+                 reverificationInterval=30, trackingScale=0.5,
+                 searchMargin=0.5, minMatchScore=0.6, minOverlap=0.3):
+
+        assert detectionInterval > 0, "'detectionInterval' must be > 0."
+        assert reverificationInterval > 0, \
+            "'reverificationInterval' must be > 0."
+        assert trackingScale > 0 and trackingScale <= 1, \
+            "'trackingScale' must be in (0, 1] interval."
+        assert minMatchScore > 0 and minMatchScore <= 1, \
+            "'minMatchScore' must be in (0, 1] interval."
+
+        self._faceDetector = faceDetector
+        self.detectionInterval = detectionInterval
+        self.reverificationInterval = reverificationInterval
+        self._trackingScale = trackingScale
+        self._searchMargin = searchMargin
+        self._minMatchScore = minMatchScore
+        self._minOverlap = minOverlap
+
+        self._tracks = []
+        self._ids = itertools.count()
+        self._framesSinceDetection = None
+
+    @property
+    def tracks(self):
+        return list(self._tracks)
+
+    @property
+    def tracksToIdentify(self):
+        return [t for t in self._tracks if t.framesSinceVerification is None \
+            or t.framesSinceVerification >= self.reverificationInterval]
+
+    def setIdentity(self, track, user, confidence):
+        track.user = user
+        track.confidence = confidence
+        track.framesSinceVerification = 0
+
+    def reset(self):
+        self._tracks = []
+        self._framesSinceDetection = None
+
+    def update(self, frame):
+        # 'frame' is a FrameBundle or a grayscale image; the detector gets it
+        # as is
+        for track in self._tracks:
+            if track.framesSinceVerification is not None:
+                track.framesSinceVerification += 1
+
+        sf = self._trackingScale
+        if isinstance(frame, FrameBundle):
+            smallFrame = frame.subsampled(sf)
+        else:
+            h, w = frame.shape
+            smallFrame = cv2.resize(frame, (int(w*sf), int(h*sf))) \
+                if sf < 1 else frame
+
+        if self._framesSinceDetection is None or \
+                self._framesSinceDetection + 1 >= self.detectionInterval or \
+                not all(self._propagate(t, smallFrame) for t in self._tracks):
+            self._detect(frame, smallFrame)
+        else:
+            self._framesSinceDetection += 1
+        return self.tracks
+
+    def _detect(self, frame, smallFrame):
+        self._framesSinceDetection = 0
+        tracks = []
+        unmatched = list(self._tracks)
+        for bbox in self._faceDetector(frame, False):
+            best = max(unmatched, key=lambda t: bboxOverlap(t.bbox, bbox)) \
+                if unmatched else None
+            if best is not None and \
+                    bboxOverlap(best.bbox, bbox) >= self._minOverlap:
+                unmatched.remove(best)
+                track = best
+                track.bbox = bbox
+            else:
+                track = FaceTrack(self._ids.next(), bbox)
+            self._updateTemplate(track, smallFrame)
+            tracks.append(track)
+        self._tracks = tracks
+
+    def _scaledBBox(self, bbox):
+        sf = self._trackingScale
+        return tuple(int(v*sf) for v in bbox)
+
+    def _updateTemplate(self, track, smallFrame):
+        x, y, w, h = self._scaledBBox(track.bbox)
+        track._template = smallFrame[y:y + h, x:x + w].copy()
+
+    def _propagate(self, track, smallFrame):
+        template = track._template
+        if template is None or template.size == 0:
+            return False
+        th, tw = template.shape
+        fh, fw = smallFrame.shape
+        x, y, w, h = self._scaledBBox(track.bbox)
+        mx, my = int(w*self._searchMargin), int(h*self._searchMargin)
+        x0, y0 = max(x - mx, 0), max(y - my, 0)
+        x1, y1 = min(x + w + mx, fw), min(y + h + my, fh)
+        if x1 - x0 < tw or y1 - y0 < th:
+            return False
+        scores = cv2.matchTemplate(smallFrame[y0:y1, x0:x1], template,
+                                   cv2.TM_CCOEFF_NORMED)
+        _, maxScore, _, (dx, dy) = cv2.minMaxLoc(scores)
+        if maxScore < self._minMatchScore:
+            return False
+        sf = self._trackingScale
+        track.bbox = (int((x0 + dx)/sf), int((y0 + dy)/sf), track.bbox[2],
+                      track.bbox[3])
+        return True
\ No newline at end of file
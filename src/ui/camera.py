@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
-import cv
 import cv2
 import numpy as np
+import threading
+import time
 
 from PyQt4 import QtCore
 from PyQt4 import QtGui
 
+from framesources import CameraSource
+from utilities import FrameBundle
+from utilities import FrameRing
+from utilities import StopWatch
+
 
 __all__ = ["OpenCVQImage",
            "CameraDevice",
@@ -21,42 +27,136 @@ class OpenCVQImage(QtGui.QImage):
             "The input must be a 3-channel image."
         assert rgbImg.dtype == np.uint8, "The input must be an 8-bit image."
 
-        self._imgData = rgbImg.tostring()
+        # the QImage wraps the array buffer without copying it, so the array
+        # is kept referenced for the QImage lifetime
+        self._imgData = np.ascontiguousarray(rgbImg)
         h, w = rgbImg.shape[0:2]
-        super(OpenCVQImage, self).__init__(self._imgData, w, h,
+        super(OpenCVQImage, self).__init__(self._imgData.data, w, h,
+                                           self._imgData.strides[0],
                                            QtGui.QImage.Format_RGB888)
 
 
-class CameraDevice(QtCore.QObject):
+class _CaptureThread(threading.Thread):
+
+    # seconds waited before reading again a live source that returned no
+    # frame, so a disconnected camera doesn't make the thread spin
+    _RETRY_INTERVAL = 0.1
+
+    def __init__(self, cameraDevice):
+        super(_CaptureThread, self).__init__(name="CameraCapture")
+        self.daemon = True
+        self._cameraDevice = cameraDevice
+        self._running = threading.Event()
+        self._stopped = False
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    @running.setter
+    def running(self, r):
+        if r:
+            self._running.set()
+        else:
+            self._running.clear()
+
+    def stop(self):
+        self._stopped = True
+        self._running.set()
+
+    def run(self):
+        while not self._stopped:
+            self._running.wait()
+            if self._stopped:
+                break
+            frame = self._cameraDevice._readFrame()
+            if frame is not None:
+                self._cameraDevice._frameRing.push(frame)
+            elif self._cameraDevice.frameSource.finished:
+                self.running = False
+            else:
+                time.sleep(self._RETRY_INTERVAL)
+
 
-    _DEFAULT_FPS = 30
+class CameraDevice(QtCore.QObject):
 
-    newFrame = QtCore.pyqtSignal(np.ndarray)
+    newFrame = QtCore.pyqtSignal(FrameBundle)
+    finished = QtCore.pyqtSignal()
 
-    def __init__(self, cameraId=0, mirrored=False, parent=None):
+    def __init__(self, cameraId=0, mirrored=False, threaded=False,
+                 bufferSize=2, frameSource=None, instrumentation=None,
+                 parent=None):
         super(CameraDevice, self).__init__(parent)
 
         self.mirrored = mirrored
-
-        self._cameraDevice = cv2.VideoCapture(cameraId)
-        if not self._cameraDevice.isOpened():
-            raise IOError("Could not open camera '%d'.", cameraId)
+        self.instrumentation = instrumentation
+
+        # any framesources.FrameSource can stand in for the camera
+        if frameSource is None:
+            frameSource = CameraSource(cameraId)
+        self._frameSource = frameSource
+
+        # a source replayed as fast as possible is read by the timer itself,
+        # so every frame is delivered once, in order, and each timeout has
+        # one to deliver; the ring would drop some and leave others to poll
+        paced = frameSource.live or frameSource.realTime
+        self._frameRing = None
+        self._captureThread = None
+        if threaded and paced:
+            self._frameRing = FrameRing(bufferSize)
+            self._captureThread = _CaptureThread(self)
+            self._captureThread.start()
 
         self._timer = QtCore.QTimer(self)
         self._timer.timeout.connect(self._queryFrame)
-        self._timer.setInterval(1000/self.fps)
+        self._timer.setInterval(1000/self.fps if paced else 0)
 
         self.paused = False
 
-    @QtCore.pyqtSlot()
-    def _queryFrame(self):
-        _, frame = self._cameraDevice.read()
+    @property
+    def frameSource(self):
+        return self._frameSource
+
+    def release(self):
+        if self._captureThread is not None:
+            self._captureThread.stop()
+            self._captureThread.join()
+            self._captureThread = None
+        self._frameSource.release()
+
+    @property
+    def threaded(self):
+        return self._frameRing is not None
+
+    @property
+    def droppedFrames(self):
+        return self._frameRing.dropped if self.threaded else 0
+
+    def _readFrame(self):
+        stopWatch = StopWatch()
+        frame = self._frameSource.read()
         if frame is None:
-            return
+            return None
         if self.mirrored:
             frame = cv2.flip(frame, 1)
-        # it's assumed the frame is in BGR format
-        self.newFrame.emit(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if self.instrumentation is not None:
+            self.instrumentation.record("capture", stopWatch.elapsedTime)
+        # it's assumed the frame is in BGR format; the other representations
+        # are computed by the bundle only if some consumer needs them
+        return FrameBundle(frame)
+
+    @QtCore.pyqtSlot()
+    def _queryFrame(self):
+        if self.threaded:
+            frame = self._frameRing.pop()
+        else:
+            frame = self._readFrame()
+        if frame is not None:
+            self.newFrame.emit(frame)
+        elif self._frameSource.finished and not \
+                (self.threaded and len(self._frameRing)):
+            self.paused = True
+            self.finished.emit()
 
     @property
     def paused(self):
@@ -68,69 +168,122 @@ class CameraDevice(QtCore.QObject):
             self._timer.stop()
         else:
             self._timer.start()
+        if self._captureThread is not None:
+            self._captureThread.running = not p
+            if p:
+                self._frameRing.clear()
 
     @property
     def fps(self):
-        fps = int(self._cameraDevice.get(cv.CV_CAP_PROP_FPS))
-        if not fps > 0:
-            fps = self._DEFAULT_FPS
-        return fps
+        return self._frameSource.fps
 
     @property
     def frameSize(self):
-        w = self._cameraDevice.get(cv.CV_CAP_PROP_FRAME_WIDTH)
-        h = self._cameraDevice.get(cv.CV_CAP_PROP_FRAME_HEIGHT)
-        return int(w), int(h)
+        return self._frameSource.frameSize
 
     @frameSize.setter
     def frameSize(self, newSize):
-        w, h = newSize
-        self._cameraDevice.set(cv.CV_CAP_PROP_FRAME_WIDTH, w)
-        self._cameraDevice.set(cv.CV_CAP_PROP_FRAME_HEIGHT, h)
+        self._frameSource.frameSize = newSize
 
 
 class CameraWidget(QtGui.QWidget):
 
-    newFrame = QtCore.pyqtSignal(np.ndarray)
+    # repaints are coalesced to this rate, whatever the camera rate is
+    _REFRESH_RATE = 60
+
+    newFrame = QtCore.pyqtSignal(FrameBundle)
 
     def __init__(self, cameraDevice, parent=None):
         super(CameraWidget, self).__init__(parent)
 
         self._frame = None
+        self._image = None
+        self._dirty = False
+        # the latencies overlay needs the device to have an instrumentation
+        self.showLatencies = False
 
         self._cameraDevice = cameraDevice
         self._cameraDevice.newFrame.connect(self._onNewFrame)
 
+        self._refreshTimer = QtCore.QTimer(self)
+        self._refreshTimer.timeout.connect(self._refresh)
+        self._refreshTimer.start(1000/self._REFRESH_RATE)
+
         w, h = self._cameraDevice.frameSize
         self.setMinimumSize(w, h)
 
-    @QtCore.pyqtSlot(cv.iplimage)
+    @QtCore.pyqtSlot(FrameBundle)
     def _onNewFrame(self, frame):
-        self._frame = frame.copy()
-        self.newFrame.emit(self._frame)
-        self.update()
+        # the consumers draw their overlays on the display image of this
+        # widget's own bundle, converted into the previous frame buffer, which
+        # is then painted as is
+        stopWatch = StopWatch()
+        frame = frame.withDisplay(self._frame)
+        self._frame = frame.display
+        self._record("colorConversion", stopWatch.elapsedTime)
+        self._image = None
+        self.newFrame.emit(frame)
+        self._dirty = True
+
+    @QtCore.pyqtSlot()
+    def _refresh(self):
+        if self._dirty:
+            self._dirty = False
+            self.update()
 
     def changeEvent(self, e):
         if e.type() == QtCore.QEvent.EnabledChange:
             if self.isEnabled():
                 self._cameraDevice.newFrame.connect(self._onNewFrame)
+                self._refreshTimer.start()
             else:
                 self._cameraDevice.newFrame.disconnect(self._onNewFrame)
+                self._refreshTimer.stop()
+
+    def _record(self, stage, elapsedTime):
+        instrumentation = self._cameraDevice.instrumentation
+        if instrumentation is not None:
+            instrumentation.record(stage, elapsedTime)
+
+    def _drawLatencies(self, painter, pt):
+        instrumentation = self._cameraDevice.instrumentation
+        if not self.showLatencies or instrumentation is None:
+            return
+        lines = ["%s: %.1f / %.1f / %.1f ms" % (stage, s["p50"]*1e3,
+            s["p95"]*1e3, s["p99"]*1e3) for stage, s in \
+            sorted(instrumentation.report().iteritems())]
+        if not lines:
+            return
+        lineHeight = painter.fontMetrics().height()
+        width = max(painter.fontMetrics().width(l) for l in lines)
+        painter.fillRect(pt.x(), pt.y(), width + 8, lineHeight*len(lines) + 8,
+                         QtGui.QColor(0, 0, 0, 160))
+        painter.setPen(QtCore.Qt.white)
+        for i, line in enumerate(lines):
+            painter.drawText(pt.x() + 4, pt.y() + 4 + lineHeight*i + \
+                painter.fontMetrics().ascent(), line)
 
     def paintEvent(self, e):
         if self._frame is None:
             return
+        stopWatch = StopWatch()
+        # the image is only built once per frame, however many times the
+        # widget is painted
+        if self._image is None:
+            self._image = OpenCVQImage(self._frame)
         painter = QtGui.QPainter(self)
         h, w = self._frame.shape[0:2]
         pt = QtCore.QPoint((self.width() - w) / 2, (self.height() - h) / 2)
-        painter.drawImage(pt, OpenCVQImage(self._frame))
+        painter.drawImage(pt, self._image)
+        self._record("painting", stopWatch.elapsedTime)
+        self._drawLatencies(painter, pt)
 
 
 def _main():
 
-    @QtCore.pyqtSlot(cv.iplimage)
-    def onNewFrame(frame):
-        cv2.cvtColor(frame, cv2.COLOR_RGB2BGR, frame)
+    @QtCore.pyqtSlot(FrameBundle)
+    def onNewFrame(frameBundle):
+        frame = frameBundle.display
         msg = "processed frame"
         h, w = frame.shape[0:2]
         tsize, baseline = cv2.getTextSize(msg, cv2.FONT_HERSHEY_PLAIN, 2, 2)
@@ -143,6 +296,7 @@ def _main():
 
     cameraDevice = CameraDevice(mirrored=True)
 
+    # the overlay only shows in the widget it's drawn for
     cameraWidget1 = CameraWidget(cameraDevice)
     cameraWidget1.newFrame.connect(onNewFrame)
     cameraWidget1.show()
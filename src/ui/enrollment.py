@@ -1,15 +1,16 @@
 # -*- coding: utf-8 -*-
 
 import cv2
-import numpy as np
 
 from PyQt4 import QtCore
 from PyQt4 import QtGui
 
 from ui.camera import CameraDevice
 from ui.camera import CameraWidget
+from utilities import ChangeDetector
 from utilities import Enroller
 from utilities import Enrollment
+from utilities import FrameBundle
 from utilities import objectDetector
 
 
@@ -49,6 +50,8 @@ class EnrollmentWidget(QtGui.QWidget):
         self._verticalLayout.addLayout(self._buttonsLayout)
 
         self._faceDetector = faceDetector
+        self._changeDetector = ChangeDetector()
+        self._detectedFace = []
 
         self._resetEnrollment()
 
@@ -67,10 +70,13 @@ class EnrollmentWidget(QtGui.QWidget):
         self._resetEnrollment()
         self.enrollmentCanceled.emit()
 
-    @QtCore.pyqtSlot(np.ndarray)
-    def _onNewFrame(self, frame):
-        grayFrame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        detectedFace = self._faceDetector(grayFrame)
+    @QtCore.pyqtSlot(FrameBundle)
+    def _onNewFrame(self, frameBundle):
+        frame = frameBundle.display
+        grayFrame = frameBundle.gray
+        if self._changeDetector.changed(grayFrame):
+            self._detectedFace = self._faceDetector(frameBundle)
+        detectedFace = self._detectedFace
         if len(detectedFace) == 0:
             return
         detectedFace = detectedFace[0]
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 
 import cv2
-import numpy as np
+import logging
+import os
+import time
 
 from PyQt4 import QtCore
 from PyQt4 import QtGui
@@ -10,8 +12,22 @@ from ui.camera import CameraDevice
 from ui.camera import CameraWidget
 from ui.enrollment import EnrollmentWidget
 from ui.settings import SettingsWidget
+from detectors import CascadeBackend
+from detectors import availableBackends
+from detectors import calibrate
+from detectors import loadValidationSet
 from facerecognizer import FaceRecognizer
+from featurecache import FeatureCache
+from framesources import frameSourceFromSpec
+from gallery import Gallery
+from instrumentation import Instrumentation
+from profiling import TechniqueProfiler
+from recognition import RecognitionWorker
+from scheduler import LoadScheduler
 from utilities import Enrollment
+from utilities import FrameBundle
+from utilities import StopWatch
+from utilities import getApplicationPath
 from utilities import objectDetector
 
 
@@ -22,9 +38,15 @@ class MainWindow(QtGui.QMainWindow):
 
     _APP_TITLE = "VIISAR - Face Recognition"
     _LOGO_PATH = "../data/viisar_logo.png"
+    _DATA_PATH = "../data"
     _FACE_DETECTOR_PATH = "../data/haarcascade_frontalface_alt2.xml"
+    _FACE_VALIDATION_SET_PATH = "../data/face_validation"
+    _TRAINING_STATUS_INTERVAL = 200
+    _TARGET_FPS = 30
+    _LATENCY_BUDGET = 0.25
 
-    def __init__(self, faceRecognizer, parent=None):
+    def __init__(self, faceRecognizer, frameSource=None, instrumentation=None,
+                 parent=None):
         super(MainWindow, self).__init__(parent)
 
         self.setWindowTitle(self._APP_TITLE)
@@ -62,8 +84,24 @@ class MainWindow(QtGui.QMainWindow):
         self._verticalLineSep.setFrameShadow(QtGui.QFrame.Sunken)
         self._horizontalLayout.addWidget(self._verticalLineSep)
 
-        self._cameraDevice = CameraDevice(mirrored=True)
-        self._faceDetector = objectDetector(self._FACE_DETECTOR_PATH)
+        self._instrumentation = instrumentation
+        self._cameraDevice = CameraDevice(mirrored=frameSource is None,
+                                          threaded=True,
+                                          frameSource=frameSource,
+                                          instrumentation=instrumentation)
+        faceDetectorBackend = self._selectFaceDetectorBackend()
+        self._faceDetector = objectDetector(faceDetectorBackend, roiMode=True)
+        self._scheduler = LoadScheduler(min(self._TARGET_FPS,
+                                            self._cameraDevice.fps),
+                                        self._LATENCY_BUDGET)
+        # the worker detects only now and then, between which the tracker
+        # follows the faces, so the previous detections are no ROI for it
+        self._recognitionWorker = RecognitionWorker( \
+            objectDetector(faceDetectorBackend),
+            self._faceRecognizer, scheduler=self._scheduler,
+            instrumentation=instrumentation)
+        self._frameStopWatch = None
+        self._recognitionWorker.start()
 
         self._rightPanelLayout = QtGui.QStackedLayout()
 
@@ -86,6 +124,58 @@ class MainWindow(QtGui.QMainWindow):
 
         self.setCentralWidget(self._centralWidget)
 
+        self._qualityLabel = QtGui.QLabel(self)
+        self.statusBar().addPermanentWidget(self._qualityLabel)
+        self._updateQualityLabel()
+
+        self._trainingStatusTimer = QtCore.QTimer(self)
+        self._trainingStatusTimer.timeout.connect(self._updateTrainingStatus)
+        self._trainingStatusTimer.start(self._TRAINING_STATUS_INTERVAL)
+
+        if instrumentation is not None:
+            showLatenciesAction = QtGui.QAction(self.tr("Show latencies"),
+                                                self)
+            showLatenciesAction.setShortcut(QtGui.QKeySequence("F3"))
+            showLatenciesAction.setCheckable(True)
+            showLatenciesAction.toggled.connect(self._onShowLatenciesToggled)
+            self.addAction(showLatenciesAction)
+            dumpLatenciesAction = QtGui.QAction(self.tr("Dump latencies"),
+                                                self)
+            dumpLatenciesAction.setShortcut(QtGui.QKeySequence("F4"))
+            dumpLatenciesAction.triggered.connect(self._dumpLatencies)
+            self.addAction(dumpLatenciesAction)
+
+        if self._faceRecognizer.profiler is not None:
+            profileAction = QtGui.QAction(self.tr("Profile technique"), self)
+            profileAction.setShortcut(QtGui.QKeySequence("F5"))
+            profileAction.setCheckable(True)
+            profileAction.setChecked(self._faceRecognizer.profiler.enabled)
+            profileAction.toggled.connect(self._onProfileToggled)
+            self.addAction(profileAction)
+            exportProfilesAction = QtGui.QAction(self.tr("Export profiles"),
+                                                 self)
+            exportProfilesAction.setShortcut(QtGui.QKeySequence("F6"))
+            exportProfilesAction.triggered.connect(self._exportProfiles)
+            self.addAction(exportProfilesAction)
+
+    def _selectFaceDetectorBackend(self):
+        backends = availableBackends(self._DATA_PATH)
+        if not backends or not os.path.isdir(self._FACE_VALIDATION_SET_PATH):
+            return CascadeBackend(self._FACE_DETECTOR_PATH)
+        backend, report = calibrate(backends, loadValidationSet( \
+            self._FACE_VALIDATION_SET_PATH), self._cameraDevice.frameSize)
+        for b, recall, elapsed in report:
+            logging.info("Face detector '%s': recall %.2f, %.1f ms/frame.",
+                         b.name, recall, elapsed*1e3)
+        logging.info("Using the '%s' face detector.", backend.name)
+        return backend
+
+    def closeEvent(self, e):
+        self._recognitionWorker.stop()
+        self._cameraDevice.paused = True
+        self._cameraDevice.release()
+        super(MainWindow, self).closeEvent(e)
+
     @QtCore.pyqtSlot()
     def _enrollmentMode(self):
         self._faceRecognitionWidget.setEnabled(False)
@@ -95,6 +185,8 @@ class MainWindow(QtGui.QMainWindow):
 
     @QtCore.pyqtSlot()
     def _faceRecognitionMode(self):
+        # the interval spent out of this mode isn't a frame interval
+        self._frameStopWatch = None
         self._enrollmentWidget.setEnabled(False)
         self._settingsWidget.setEnabled(True)
         self._faceRecognitionWidget.setEnabled(True)
@@ -115,17 +207,81 @@ class MainWindow(QtGui.QMainWindow):
     def _onTechniqueChanged(self, technique):
         self._faceRecognizer.selectTechniqueByName(unicode(technique))
 
-    @QtCore.pyqtSlot(np.ndarray)
-    def _faceRecognition(self, frame):
-        grayFrame = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
-        detectedFaces = self._faceDetector(grayFrame, False)
-        h, w = frame.shape[0:2]
-        for bbox in detectedFaces:
+    @QtCore.pyqtSlot()
+    def _updateTrainingStatus(self):
+        state = self._faceRecognizer.trainingState
+        if state == "training":
+            self._settingsWidget.trainingProgress = \
+                int(self._faceRecognizer.trainingProgress*100)
+            return
+        self._settingsWidget.trainingProgress = None
+        if state == "failed" and self._settingsWidget.isEnabled():
+            self.statusBar().showMessage(self.tr("Training failed: %1").arg( \
+                unicode(self._faceRecognizer.trainingError)),
+                self._TRAINING_STATUS_INTERVAL*2)
+
+    @QtCore.pyqtSlot(bool)
+    def _onShowLatenciesToggled(self, checked):
+        self._faceRecognitionWidget.showLatencies = checked
+
+    @QtCore.pyqtSlot()
+    def _dumpLatencies(self):
+        path = os.path.join(getApplicationPath(), "latencies-%s.json" % \
+            time.strftime("%Y%m%d-%H%M%S"))
+        try:
+            self._instrumentation.dump(path)
+        except IOError as e:
+            logging.warning("Couldn't dump the latencies: %s.", e)
+            return
+        self.statusBar().showMessage(self.tr("Latencies dumped to %1").arg( \
+            path), self._TRAINING_STATUS_INTERVAL*10)
+
+    @QtCore.pyqtSlot(bool)
+    def _onProfileToggled(self, checked):
+        self._faceRecognizer.profiler.enabled = checked
+        self.statusBar().showMessage(self.tr("Profiling %1").arg( \
+            self.tr("enabled") if checked else self.tr("disabled")),
+            self._TRAINING_STATUS_INTERVAL*10)
+
+    @QtCore.pyqtSlot()
+    def _exportProfiles(self):
+        path = os.path.join(getApplicationPath(), "profiles-%s" % \
+            time.strftime("%Y%m%d-%H%M%S"))
+        try:
+            filenames = self._faceRecognizer.profiler.export(path)
+        except IOError as e:
+            logging.warning("Couldn't export the profiles: %s.", e)
+            return
+        self.statusBar().showMessage(self.tr("%1 profiles exported to %2"). \
+            arg(len(filenames)).arg(path), self._TRAINING_STATUS_INTERVAL*10)
+
+    def _updateQualityLabel(self):
+        self._qualityLabel.setText(self.tr("Degradation level: %1/%2").arg( \
+            self._scheduler.level).arg(self._scheduler.maxLevel))
+
+    def _updateScheduler(self):
+        if self._frameStopWatch is None:
+            self._frameStopWatch = StopWatch()
+        else:
+            self._scheduler.record("frame", self._frameStopWatch.elapsedTime)
+            self._frameStopWatch.start()
+        level = self._scheduler.level
+        if self._scheduler.update() != level:
+            self._updateQualityLabel()
+
+    @QtCore.pyqtSlot(FrameBundle)
+    def _faceRecognition(self, frameBundle):
+        self._updateScheduler()
+        self._recognitionWorker.submit(frameBundle)
+        stopWatch = StopWatch()
+        frame = frameBundle.display
+        # the overlay shows the most recent results, which may be a few frames
+        # behind the live preview
+        for bbox, user, confidence in self._recognitionWorker.results:
             pt1 = (bbox[0], bbox[1])
             pt2 = (pt1[0] + bbox[2], pt1[1] + bbox[3])
             cv2.rectangle(frame, pt1, pt2, (255, 0, 0), 2)
 
-            confidence, user = self._faceRecognizer.identify(grayFrame, bbox)
             if user is not None:
                 msg = "%s (%.2f)" % (user, confidence)
             else:
@@ -135,6 +291,8 @@ class MainWindow(QtGui.QMainWindow):
             tpt = pt1[0] - (tsize[0] - bbox[2]) / 2, pt2[1] + tsize[1]
             cv2.putText(frame, msg, tpt, cv2.FONT_HERSHEY_DUPLEX, 1,
                         (255, 0, 0))
+        if self._instrumentation is not None:
+            self._instrumentation.record("drawing", stopWatch.elapsedTime)
 
     @QtCore.pyqtSlot(Enrollment)
     def _onEnrollmentConcluded(self, enrollment):
@@ -162,10 +320,35 @@ class MainWindow(QtGui.QMainWindow):
 
 
 def _main():
+    import argparse
     import sys
     app = QtGui.QApplication(sys.argv)
-    faceRecognizer = FaceRecognizer("./plugins")
-    mainWindow = MainWindow(faceRecognizer)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", help="frame source: 'camera[:id]', "
+                        "'video:<path>', 'images:<dir>' or 'synthetic[:WxH]'")
+    parser.add_argument("--fast", action="store_true", help="replay recorded "
+                        "sources as fast as possible")
+    parser.add_argument("--profile", choices=TechniqueProfiler.MODES,
+                        default=TechniqueProfiler.MODES[0],
+                        help="profiling mode of the techniques, toggled with "
+                        "F5 and exported with F6")
+    parser.add_argument("--profile-at-start", action="store_true")
+    parser.add_argument("--isolated", action="store_true", help="run each "
+                        "technique in its own worker process")
+    args = parser.parse_args(map(unicode, app.arguments())[1:])
+    frameSource = frameSourceFromSpec(args.source, not args.fast) if \
+        args.source else None
+    Enrollment.featureCache = FeatureCache(os.path.join(getApplicationPath(),
+                                                        "features"))
+    Enrollment.faceDetector = staticmethod(objectDetector( \
+        MainWindow._FACE_DETECTOR_PATH))
+    gallery = Gallery(os.path.join(getApplicationPath(), "gallery"))
+    instrumentation = Instrumentation()
+    profiler = TechniqueProfiler(args.profile)
+    profiler.enabled = args.profile_at_start
+    faceRecognizer = FaceRecognizer("./plugins", gallery, getApplicationPath(),
+                                    instrumentation, profiler, args.isolated)
+    mainWindow = MainWindow(faceRecognizer, frameSource, instrumentation)
     mainWindow.show()
     sys.exit(app.exec_())
 
@@ -20,6 +20,11 @@ class SettingsWidget(QtGui.QWidget, Ui_SettingsWidget):
         super(SettingsWidget, self).__init__(parent)
         self.setupUi(self)
 
+        self._trainingProgressBar = QtGui.QProgressBar(self)
+        self._trainingProgressBar.setFormat(self.tr("Training... %p%"))
+        self._trainingProgressBar.hide()
+        self.verticalLayout.addWidget(self._trainingProgressBar)
+
         self._updateSecurityTolLabel()
 
         self.newUserButton.clicked.connect(self.newUserButtonClicked)
@@ -62,7 +67,7 @@ class SettingsWidget(QtGui.QWidget, Ui_SettingsWidget):
     @users.setter
     def users(self, users):
         self.usersList.clear()
-        self.usersList.addItems(filter(len, map(str.strip, set(users))))
+        self.usersList.addItems(filter(len, [u.strip() for u in set(users)]))
 
     @property
     def selectedUser(self):
@@ -117,6 +122,20 @@ class SettingsWidget(QtGui.QWidget, Ui_SettingsWidget):
         if techniqueIndex > -1:
             self.techniqueCombo.setCurrentIndex(techniqueIndex)
 
+    @property
+    def trainingProgress(self):
+        if self._trainingProgressBar.isHidden():
+            return None
+        return self._trainingProgressBar.value()
+
+    @trainingProgress.setter
+    def trainingProgress(self, progress):
+        if progress is None:
+            self._trainingProgressBar.hide()
+        else:
+            self._trainingProgressBar.setValue(progress)
+            self._trainingProgressBar.show()
+
 
 def _main():
     import sys
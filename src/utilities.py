@@ -1,14 +1,26 @@
 # -*- coding: utf-8 -*-
 
+import collections
 import cv2
+import hashlib
+import logging
+import numpy as np
 import os
+import Queue
 import shutil
+import threading
 import uuid
 
+from multiprocessing.pool import ThreadPool
+
 
 __all__ = ["StopWatch",
+           "FrameRing",
+           "FrameBundle",
+           "ChangeDetector",
            "Enrollment",
            "Enroller",
+           "bboxOverlap",
            "objectDetector",
            "getApplicationPath"]
 
@@ -37,34 +49,360 @@ class StopWatch(object):
         return (cv2.getTickCount() - self._time) / cv2.getTickFrequency()
 
 
+class FrameRing(object):
+
+    def __init__(self, capacity=2):
+
+        assert capacity > 0, "'capacity' must be > 0."
+
+        self._frames = collections.deque(maxlen=capacity)
+        self._cond = threading.Condition()
+        self._pushed = 0
+        self._dropped = 0
+
+    def __len__(self):
+        with self._cond:
+            return len(self._frames)
+
+    @property
+    def capacity(self):
+        return self._frames.maxlen
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+    def push(self, frame):
+        with self._cond:
+            if len(self._frames) == self._frames.maxlen:
+                self._dropped += 1
+            self._frames.append(frame)
+            self._pushed += 1
+            self._cond.notify_all()
+
+    def pop(self, timeout=0):
+        # returns the newest frame and discards the older ones, so consumers
+        # never fall behind the producer
+        with self._cond:
+            if timeout is None:
+                while not self._frames:
+                    self._cond.wait()
+            elif not self._frames and timeout > 0:
+                self._cond.wait(timeout)
+            if not self._frames:
+                return None
+            frame = self._frames.pop()
+            self._dropped += len(self._frames)
+            self._frames.clear()
+            return frame
+
+    def clear(self):
+        with self._cond:
+            self._frames.clear()
+
+
+class FrameBundle(object):
+
+    def __init__(self, bgr):
+        # the representations are computed on demand, at most once per frame,
+        # and shared by every consumer; they must be treated as read-only,
+        # except 'display', which is meant to be drawn on
+        self._bgr = bgr
+        self._rgb = None
+        self._gray = None
+        self._display = None
+        self._displayBuffer = None
+        self._subsampled = {}
+        self._lock = threading.Lock()
+        # the bundle holding the shared representations
+        self._shared = self
+
+    def withDisplay(self, buffer=None):
+        # a bundle of the same frame, sharing its representations but with
+        # its own display image, converted into 'buffer' when it fits; each
+        # consumer drawing overlays takes one, so they don't show in the
+        # others
+        ret = FrameBundle(self._bgr)
+        ret._shared = self._shared
+        ret._displayBuffer = buffer
+        return ret
+
+    @property
+    def bgr(self):
+        return self._bgr
+
+    @property
+    def shape(self):
+        return self._bgr.shape
+
+    @property
+    def rgb(self):
+        shared = self._shared
+        with shared._lock:
+            if shared._rgb is None:
+                shared._rgb = cv2.cvtColor(self._bgr, cv2.COLOR_BGR2RGB)
+            return shared._rgb
+
+    @property
+    def gray(self):
+        shared = self._shared
+        with shared._lock:
+            if shared._gray is None:
+                shared._gray = cv2.cvtColor(self._bgr, cv2.COLOR_BGR2GRAY)
+            return shared._gray
+
+    @property
+    def display(self):
+        with self._lock:
+            if self._display is None:
+                buffer = self._displayBuffer
+                if buffer is not None and buffer.shape != self._bgr.shape:
+                    buffer = None
+                self._display = cv2.cvtColor(self._bgr, cv2.COLOR_BGR2RGB,
+                                             buffer)
+            return self._display
+
+    def subsampled(self, scaleFactor):
+        gray = self.gray
+        shared = self._shared
+        with shared._lock:
+            img = shared._subsampled.get(scaleFactor)
+            if img is None:
+                h, w = gray.shape
+                img = cv2.resize(gray, (int(w*scaleFactor),
+                                        int(h*scaleFactor)))
+                shared._subsampled[scaleFactor] = img
+            return img
+
+
+class ChangeDetector(object):
+
+    def __init__(self, gridSize=(16, 12), threshold=8, minChangedBlocks=1,
+                 maxUnchangedFrames=30):
+
+        assert threshold > 0, "'threshold' must be > 0."
+        assert minChangedBlocks > 0, "'minChangedBlocks' must be > 0."
+        assert maxUnchangedFrames > 0, "'maxUnchangedFrames' must be > 0."
+
+        self._gridSize = gridSize
+        self._threshold = threshold
+        self._minChangedBlocks = minChangedBlocks
+        self._maxUnchangedFrames = maxUnchangedFrames
+        self.reset()
+
+    def reset(self):
+        self._reference = None
+        self._unchangedFrames = 0
+
+    def changed(self, grayFrame):
+        # area interpolation averages each block, which is enough to tell
+        # whether anything moved
+        blocks = cv2.resize(grayFrame, self._gridSize,
+                            interpolation=cv2.INTER_AREA).astype(np.int16)
+        if self._reference is not None and \
+                self._unchangedFrames + 1 < self._maxUnchangedFrames:
+            changedBlocks = np.count_nonzero(np.abs(blocks - \
+                self._reference) > self._threshold)
+            if changedBlocks < self._minChangedBlocks:
+                self._unchangedFrames += 1
+                return False
+        # the reference is only replaced on changes, so slow drifts add up
+        # until they're noticed
+        self._reference = blocks
+        self._unchangedFrames = 0
+        return True
+
+
+_PACK_MAGIC = "FRS1"
+# offset, crop x, crop y, crop w, crop h, bbox x, bbox y, bbox w, bbox h
+_PACK_INDEX_COLS = 9
+
+
+def _cropSample(frame, bbox, margin):
+    x, y, w, h = bbox
+    fh, fw = frame.shape[0:2]
+    mx, my = int(w*margin), int(h*margin)
+    x0, y0 = max(x - mx, 0), max(y - my, 0)
+    x1, y1 = min(x + w + mx, fw), min(y + h + my, fh)
+    crop = np.ascontiguousarray(frame[y0:y1, x0:x1])
+    return crop, (x0, y0), (x - x0, y - y0, w, h)
+
+
+def _writeSamplesPack(path, samples):
+    index = np.zeros((len(samples), _PACK_INDEX_COLS), dtype="<i4")
+    offset = len(_PACK_MAGIC) + 4 + index.nbytes
+    for i, (crop, (cx, cy), bbox) in enumerate(samples):
+        ch, cw = crop.shape[0:2]
+        index[i] = (offset, cx, cy, cw, ch) + tuple(bbox)
+        offset += crop.nbytes
+    tmpPath = path + ".tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(_PACK_MAGIC)
+        np.array([len(samples)], dtype="<u4").tofile(f)
+        index.tofile(f)
+        for crop, _, _ in samples:
+            crop.astype(np.uint8).tofile(f)
+    os.rename(tmpPath, path)
+
+
+def _readSamplesPack(path):
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    headerSize = len(_PACK_MAGIC) + 4
+    if data[:len(_PACK_MAGIC)].tostring() != _PACK_MAGIC:
+        raise IOError("Invalid samples pack: '%s'" % path)
+    count = int(data[len(_PACK_MAGIC):headerSize].view("<u4")[0])
+    indexSize = count*_PACK_INDEX_COLS*4
+    index = data[headerSize:headerSize + indexSize].view("<i4").reshape( \
+        count, _PACK_INDEX_COLS)
+    ret = []
+    for offset, cx, cy, cw, ch, bx, by, bw, bh in index:
+        crop = data[offset:offset + cw*ch].reshape(ch, cw)
+        ret.append((crop, (int(cx), int(cy)),
+                    (int(bx), int(by), int(bw), int(bh))))
+    return ret
+
+
 class Enrollment(object):
 
-    def __init__(self, id, bboxes):
-        self._path = os.path.join(Enroller._BASE_PATH, id)
+    # a featurecache.FeatureCache shared by all the enrollments; when set,
+    # the faces processed by Plugin methods are cached per technique
+    featureCache = None
+    # a staticmethod wrapping an objectDetector, which finds the faces of the
+    # legacy enrollments as they didn't keep their bboxes; the whole frames
+    # are used when unset
+    faceDetector = None
+
+    def __init__(self, id, bboxes=None):
+        self._id = id
         self._bboxes = bboxes
+        self._sampleHashes = None
 
     @property
     def id(self):
-        return os.path.basename(self._path)
+        return self._id
+
+    @property
+    def _packPath(self):
+        return os.path.join(Enroller._BASE_PATH,
+                            "%s.%s" % (self._id, Enroller._SAMPLES_FORMAT))
+
+    @property
+    def _legacyPath(self):
+        return os.path.join(Enroller._BASE_PATH, self._id)
+
+    @property
+    def bboxes(self):
+        if self._bboxes is None:
+            self._bboxes = [(cx + bx, cy + by, bw, bh) for _, (cx, cy), \
+                (bx, by, bw, bh) in self._loadSamples()]
+        return self._bboxes
+
+    def _loadSamples(self):
+        if not os.path.exists(self._packPath):
+            self.migrate()
+        if not os.path.exists(self._packPath):
+            return []
+        return _readSamplesPack(self._packPath)
 
     def getProcessedFaces(self, f):
+        # the frames hold only the margin-padded face crops, so the bboxes
+        # are relative to them
+        samples = self._loadSamples()
+        technique = getattr(f, "im_self", None)
+        techniqueKey = getattr(technique, "featuresKey", None)
+        if self.featureCache is None or techniqueKey is None:
+            return [f(crop, bbox) for crop, _, bbox in samples]
+
+        if self._sampleHashes is None:
+            self._sampleHashes = [hashlib.sha1(crop.tostring() + \
+                repr(bbox)).hexdigest() for crop, _, bbox in samples]
+        cls = type(technique)
+        techniqueName = "%s.%s.%s" % (cls.__module__, cls.__name__,
+                                      f.__name__)
+        techniqueKey = "%s.%s" % (techniqueKey, f.__name__)
         ret = []
-        for i, bbox in enumerate(self._bboxes):
-            path = os.path.join(self._path,
-                                "%d.%s" % (i, Enroller._SAMPLES_FORMAT))
+        for (crop, _, bbox), sampleHash in zip(samples, self._sampleHashes):
+            key = self.featureCache.key(self._id, sampleHash, techniqueName,
+                                        techniqueKey)
+            features = self.featureCache.get(key)
+            if features is None:
+                features = f(crop, bbox)
+                if isinstance(features, np.ndarray):
+                    self.featureCache.put(key, features)
+            ret.append(features)
+        return ret
+
+    def _legacyIndices(self):
+        return sorted(int(os.path.splitext(f)[0]) for f in \
+            os.listdir(self._legacyPath) if f.endswith("." + \
+            Enroller._LEGACY_SAMPLES_FORMAT) and \
+            os.path.splitext(f)[0].isdigit())
+
+    def migrate(self):
+        # converts the enrollments stored as one full frame PNG per sample;
+        # those didn't keep the bboxes, so unless the instance knows them
+        # the faces are detected again
+        if not os.path.isdir(self._legacyPath):
+            return
+        samples = []
+        for i in self._legacyIndices():
+            path = os.path.join(self._legacyPath,
+                                "%d.%s" % (i, Enroller._LEGACY_SAMPLES_FORMAT))
             frame = cv2.imread(path, cv2.CV_LOAD_IMAGE_GRAYSCALE)
-            if frame is not None:
-                ret.append(f(frame, bbox))
+            if frame is None:
+                continue
+            if self._bboxes and i < len(self._bboxes):
+                bbox = self._bboxes[i]
+            else:
+                bboxes = self.faceDetector(frame) if self.faceDetector \
+                    is not None else []
+                bbox = bboxes[0] if bboxes else (0, 0) + frame.shape[::-1]
+            samples.append(_cropSample(frame, bbox, Enroller._CROP_MARGIN))
+        _writeSamplesPack(self._packPath, samples)
+        shutil.rmtree(self._legacyPath, ignore_errors=True)
+        self._bboxes = None
+        self._sampleHashes = None
+
+    @staticmethod
+    def migrateAll():
+        # converts every legacy enrollment at once, instead of on their first
+        # load; only the directories holding numbered samples are, and their
+        # ids are returned
+        if not os.path.isdir(Enroller._BASE_PATH):
+            return []
+        ret = []
+        for id in sorted(os.listdir(Enroller._BASE_PATH)):
+            enrollment = Enrollment(id)
+            if not os.path.isdir(enrollment._legacyPath) or \
+                    os.path.exists(enrollment._packPath):
+                continue
+            if enrollment._legacyIndices():
+                enrollment.migrate()
+                ret.append(id)
+        return ret
+
+    def saveAs(self, id):
+        # a copy of the enrollment under another id
+        ret = Enrollment(id)
+        _writeSamplesPack(ret._packPath, self._loadSamples())
         return ret
 
     def delete(self):
-        shutil.rmtree(self._path, ignore_errors=True)
+        try:
+            os.remove(self._packPath)
+        except os.error:
+            pass
+        shutil.rmtree(self._legacyPath, ignore_errors=True)
+        if self.featureCache is not None:
+            self.featureCache.purge(self._id)
 
 
 class Enroller(object):
 
     _BASE_PATH = os.path.join(getApplicationPath(), "enrollments")
-    _SAMPLES_FORMAT = "png"
+    _SAMPLES_FORMAT = "pack"
+    _LEGACY_SAMPLES_FORMAT = "png"
+    _CROP_MARGIN = 0.25
 
     def __init__(self, samplesToAcquire=30, intervalBtwSamples=0.5):
 
@@ -74,44 +412,138 @@ class Enroller(object):
         self._samplesToAcquire = samplesToAcquire
         self._intervalBtwSamples = intervalBtwSamples
 
-        self._path = os.path.join(self._BASE_PATH, uuid.uuid4().hex)
-
         try:
-            os.makedirs(self._path)
+            if not os.path.exists(self._BASE_PATH):
+                os.makedirs(self._BASE_PATH)
         except os.error as e:
             raise IOError("%s: '%s'" % (e.strerror, e.filename))
 
-        self._bboxes = []
+        self._id = uuid.uuid4().hex
+        self._samples = []
         self._stopWatch = StopWatch()
 
-    def __del__(self):
-        if self.progress < 1:
-            shutil.rmtree(self._path, ignore_errors=True)
-
     @property
     def progress(self):
-        return float(len(self._bboxes)) / self._samplesToAcquire
+        return float(len(self._samples)) / self._samplesToAcquire
 
     @property
     def enrollment(self):
         if self.progress < 1:
             return None
-        return Enrollment(os.path.basename(self._path), self._bboxes)
+        return Enrollment(self._id, [(cx + bx, cy + by, bw, bh) for _, \
+            (cx, cy), (bx, by, bw, bh) in self._samples])
 
     def enroll(self, frame, bbox):
         if self.progress < 1 and self._stopWatch.elapsedTime >= \
                 self._intervalBtwSamples:
-            path = os.path.join(self._path, "%d.%s" % (len(self._bboxes),
-                                                       self._SAMPLES_FORMAT))
-            if not cv2.imwrite(path, frame):
-                raise IOError("Could not enroll sample '%s'." % path)
-            self._bboxes.append(bbox)
+            self._samples.append(_cropSample(frame, bbox, self._CROP_MARGIN))
             self._stopWatch.start()
-
-
-def objectDetector(detectorFilename, minObjRelDim=0.3, maxObjRelDim=1,
+            if self.progress == 1:
+                path = os.path.join(self._BASE_PATH, "%s.%s" % \
+                    (self._id, self._SAMPLES_FORMAT))
+                try:
+                    _writeSamplesPack(path, self._samples)
+                except (IOError, os.error) as e:
+                    del self._samples[-1]
+                    raise IOError("Could not enroll samples '%s': %s" % \
+                        (path, e))
+
+
+def bboxOverlap(bbox1, bbox2):
+    x1, y1, w1, h1 = bbox1
+    x2, y2, w2, h2 = bbox2
+    iw = min(x1 + w1, x2 + w2) - max(x1, x2)
+    ih = min(y1 + h1, y2 + h2) - max(y1, y2)
+    if iw <= 0 or ih <= 0:
+        return 0.
+    intersection = float(iw*ih)
+    return intersection / (w1*h1 + w2*h2 - intersection)
+
+
+def _expandBBox(bbox, margin, imgSize):
+    x, y, w, h = bbox
+    imgW, imgH = imgSize
+    m = int(max(w, h)*margin)
+    x0, y0 = max(x - m, 0), max(y - m, 0)
+    x1, y1 = min(x + w + m, imgW), min(y + h + m, imgH)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def _mergeWindows(windows):
+    # overlapping windows are merged into their bounding box so no region is
+    # scanned twice
+    windows = list(windows)
+    merged = True
+    while merged:
+        merged = False
+        for i, j in ((i, j) for i in xrange(len(windows)) \
+                for j in xrange(i + 1, len(windows))):
+            x1, y1, w1, h1 = windows[i]
+            x2, y2, w2, h2 = windows[j]
+            if x1 < x2 + w2 and x2 < x1 + w1 and y1 < y2 + h2 and \
+                    y2 < y1 + h1:
+                x0, y0 = min(x1, x2), min(y1, y2)
+                windows[i] = (x0, y0, max(x1 + w1, x2 + w2) - x0,
+                              max(y1 + h1, y2 + h2) - y0)
+                del windows[j]
+                merged = True
+                break
+    return windows
+
+
+def _tileWindows(imgSize, tiles, overlap):
+    # adjacent tiles overlap by the biggest object dimension, half on each
+    # side of the seam, so every object fits entirely in at least one tile;
+    # when the overlap isn't smaller than a tile, tiling saves nothing
+    w, h = imgSize
+    rows, cols = tiles
+    tileW, tileH = -(-w // cols), -(-h // rows)
+    if overlap >= min(tileW, tileH):
+        return [(0, 0, w, h)]
+    before, after = overlap // 2, overlap - overlap // 2
+    windows = []
+    for r in xrange(rows):
+        for c in xrange(cols):
+            x0, y0 = max(c*tileW - before, 0), max(r*tileH - before, 0)
+            x1, y1 = min((c + 1)*tileW + after, w), \
+                min((r + 1)*tileH + after, h)
+            windows.append((x0, y0, x1 - x0, y1 - y0))
+    return windows
+
+
+_pool = None
+_poolLock = threading.Lock()
+
+
+def _threadPool():
+    # a single pool shared by every detector, so none leaks its threads; the
+    # parallelism of a detector is bounded by its classifiers
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = ThreadPool(cv2.getNumberOfCPUs())
+        return _pool
+
+
+def _nonMaximumSuppression(objs, maxOverlap=0.5):
+    # an object is dropped when most of it is covered by a bigger one, which
+    # also handles the partial detections cut by the tile seams
+    ret = []
+    for x, y, w, h in sorted(objs, key=lambda o: o[2]*o[3], reverse=True):
+        for kx, ky, kw, kh in ret:
+            iw = min(x + w, kx + kw) - max(x, kx)
+            ih = min(y + h, ky + kh) - max(y, ky)
+            if iw > 0 and ih > 0 and iw*ih > maxOverlap*w*h:
+                break
+        else:
+            ret.append((x, y, w, h))
+    return ret
+
+
+def objectDetector(detectorBackend, minObjRelDim=0.3, maxObjRelDim=1,
                    classifierPyrScaleFactor=1.15, minNeighbors=3,
-                   subsamplingScaleFactor=0.35):
+                   subsamplingScaleFactor=0.35, roiMode=False, roiMargin=0.5,
+                   fullScanInterval=10, tiles=None, workers=None):
 
     assert minObjRelDim < maxObjRelDim, \
         "'minObjRelDim' must be < 'maxObjRelDim'."
@@ -124,36 +556,144 @@ def objectDetector(detectorFilename, minObjRelDim=0.3, maxObjRelDim=1,
     assert minNeighbors > 0, "'minNeighbors' must be > 0."
     assert subsamplingScaleFactor > 0 and subsamplingScaleFactor <= 1, \
         "'subsamplingScaleFactor' must be in (0, 1] interval."
-    sf = subsamplingScaleFactor
+    assert roiMargin >= 0, "'roiMargin' must be >= 0."
+    assert fullScanInterval > 0, "'fullScanInterval' must be > 0."
+    # tiles overlap by the biggest object dimension, so they only pay off
+    # with a bounded 'maxObjRelDim': it must be smaller than the relative
+    # dimension of a tile, e.g. < 0.5 for 2x2 tiles, or the whole image is
+    # scanned at once
+    assert tiles is None or (tiles[0] > 0 and tiles[1] > 0), \
+        "'tiles' must have positive rows and columns."
+    assert workers is None or workers > 0, "'workers' must be > 0."
+    defaultSf = subsamplingScaleFactor
+
+    # 'detectorBackend' is a detectors.DetectorBackend or a cascade filename
+    if isinstance(detectorBackend, basestring):
+        from detectors import CascadeBackend
+        detectorBackend = CascadeBackend(detectorBackend)
+
+    if workers is None:
+        workers = cv2.getNumberOfCPUs() if tiles else 1
+    # detectMultiScale releases the GIL, so the tiles are scanned by threads,
+    # each one with its own classifier
+    classifiers = Queue.Queue()
+    for _ in xrange(workers):
+        classifiers.put(detectorBackend.load())
+    pool = _threadPool() if workers > 1 else None
+
+    # objects found by the previous call and calls since the last full scan,
+    # used by the ROI mode
+    state = {"objs": [], "framesSinceFullScan": None,
+             "tilingCollapsed": False}
+
+    def scan(img, window, sf, minObjDim, maxObjDim, detectorMode,
+             bundle=None):
+        wx, wy, ww, wh = window
+        subsampledW, subsampledH = int(ww*sf), int(wh*sf)
+        if min(subsampledW, subsampledH) < minObjDim:
+            return []
+        if bundle is not None and (ww, wh) == img.shape[::-1]:
+            subsampledImg = bundle.subsampled(sf)
+        else:
+            subsampledImg = cv2.resize(img[wy:wy + wh, wx:wx + ww],
+                                       (subsampledW, subsampledH))
+
+        classifier = classifiers.get()
+        try:
+            objs = classifier.detectMultiScale(subsampledImg,
+                                               classifierPyrScaleFactor,
+                                               minNeighbors, detectorMode,
+                                               (minObjDim, minObjDim))
+        finally:
+            classifiers.put(classifier)
 
-    classifier = cv2.CascadeClassifier(detectorFilename)
-    if classifier.empty():
-        raise ValueError("The detector '%s' could not be loaded." % \
-            detectorFilename)
+        ret = []
+        for x, y, w, h in objs:
+            if max(w, h) > maxObjDim:
+                continue
+            ret.append((wx + int(x/sf), wy + int(y/sf), int(w/sf), int(h/sf)))
+        return ret
 
-    def detector(img, biggestObj=True):
+    def scanAll(img, windows, sf, minObjDim, maxObjDim, detectorMode,
+                bundle):
+        args = [(img, window, sf, minObjDim, maxObjDim, detectorMode,
+                 bundle) for window in windows]
+        if pool is None or len(windows) < 2:
+            results = [scan(*a) for a in args]
+        else:
+            results = pool.map(lambda a: scan(*a), args)
+        objs = [o for r in results for o in r]
+        return _nonMaximumSuppression(objs) if len(windows) > 1 else objs
+
+    def detector(img, biggestObj=True, subsamplingScaleFactor=None):
+        # a FrameBundle shares its grayscale and subsampled versions
+        bundle = None
+        if isinstance(img, FrameBundle):
+            bundle = img
+            img = bundle.gray
         assert img.ndim == 2, "The input must be an 1-channel image."
 
+        # the subsampling may be overridden per call to trade accuracy for
+        # speed under load
+        sf = subsamplingScaleFactor or defaultSf
+        assert sf > 0 and sf <= 1, \
+            "'subsamplingScaleFactor' must be in (0, 1] interval."
+
+        # the objects dimensions are always relative to the whole image, even
+        # when only some regions of it are scanned
         h, w = img.shape
-        subsampledW, subsampledH = int(w*sf), int(h*sf)
-        minSubsampledDim = min(subsampledW, subsampledH)
+        minSubsampledDim = min(int(w*sf), int(h*sf))
         minObjDim = int(minSubsampledDim*minObjRelDim)
         maxObjDim = int(minSubsampledDim*maxObjRelDim)
-        subsampledImg = cv2.resize(img, (subsampledW, subsampledH))
 
         detectorMode = cv2.CASCADE_FIND_BIGGEST_OBJECT if biggestObj else \
             cv2.CASCADE_DO_CANNY_PRUNING
 
-        objs = classifier.detectMultiScale(subsampledImg,
-                                           classifierPyrScaleFactor,
-                                           minNeighbors,
-                                           detectorMode, (minObjDim, minObjDim))
-
-        ret = []
-        for x, y, w, h in objs:
-            if max(w, h) > maxObjDim:
-                continue
-            ret.append((int(x/sf), int(y/sf), int(w/sf), int(h/sf)))
+        fullScan = not roiMode or not state["objs"] or \
+            state["framesSinceFullScan"] is None or \
+            state["framesSinceFullScan"] + 1 >= fullScanInterval
+        if not fullScan:
+            windows = _mergeWindows(_expandBBox(o, roiMargin, (w, h)) \
+                for o in state["objs"])
+            ret = scanAll(img, windows, sf, minObjDim, maxObjDim,
+                          detectorMode, bundle)
+            state["framesSinceFullScan"] += 1
+            # a face that disappeared may have moved out of its window
+            fullScan = len(ret) < len(state["objs"])
+        if fullScan:
+            windows = [(0, 0, w, h)] if tiles is None else \
+                _tileWindows((w, h), tiles, int(maxObjDim/sf))
+            if tiles is not None and len(windows) == 1 and \
+                    not state["tilingCollapsed"]:
+                state["tilingCollapsed"] = True
+                logging.warning("The %dx%d tiles collapse to a single window "
+                                "with 'maxObjRelDim' %g; it must be smaller "
+                                "than the relative tile dimension.", tiles[0],
+                                tiles[1], maxObjRelDim)
+            ret = scanAll(img, windows, sf, minObjDim, maxObjDim,
+                          detectorMode, bundle)
+            state["framesSinceFullScan"] = 0
+
+        if biggestObj and len(ret) > 1:
+            ret = [max(ret, key=lambda o: o[2]*o[3])]
+        if roiMode:
+            state["objs"] = ret
         return ret
 
-    return detector
\ No newline at end of file
+    detector.subsamplingScaleFactor = defaultSf
+    return detector
+
+
+def _main():
+    import sys
+    # the faces of the legacy enrollments are found by the given cascade
+    path = sys.argv[1] if len(sys.argv) > 1 else \
+        "../data/haarcascade_frontalface_alt2.xml"
+    Enrollment.faceDetector = staticmethod(objectDetector(path))
+    ids = Enrollment.migrateAll()
+    print "Migrated '%s': %d enrollments converted." % (Enroller._BASE_PATH,
+                                                        len(ids))
+
+
+if __name__ == "__main__":
+    _main()
\ No newline at end of file